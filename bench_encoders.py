@@ -0,0 +1,63 @@
+# bench_encoders.py
+# Mide tiempo de codificación y tamaño de cada mitad por DPI y codificador.
+# Uso:  python bench_encoders.py [mazo.pdf] --dpi 120 200 300 --encoders png png:1 jpeg:85 webp:80 --colors rgb gray
+
+import argparse
+import statistics
+import time
+
+import fitz  # PyMuPDF
+
+from hanzi_render import COLOR_MODES, parse_encoder, rasterize_halves
+
+DEFAULT_DPIS = (120, 160, 200, 240, 300)
+DEFAULT_ENCODERS = ("png", "png:1", "png:6", "jpeg:85", "webp:80")
+
+def _sample_document(pages: int) -> "fitz.Document":
+    """PDF sintético apaisado con texto y trazos vectoriales a cada lado."""
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page(width=842, height=595)
+        page.insert_text((80, 280), f"Ficha {n + 1}", fontsize=72)
+        page.insert_text((500, 260), "pinyin / significado", fontsize=28)
+        for k in range(60):
+            page.draw_line((40 + 6 * k, 400), (380 - 5 * k, 560), width=0.5)
+        page.draw_line((421, 0), (421, 595))
+    return doc
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de codificadores de imagen por DPI.")
+    parser.add_argument("pdf", nargs="?", help="PDF a medir (por defecto, uno sintético)")
+    parser.add_argument("--pages", type=int, default=5, help="Páginas a muestrear")
+    parser.add_argument("--dpi", type=int, nargs="+", default=list(DEFAULT_DPIS))
+    parser.add_argument("--encoders", nargs="+", default=list(DEFAULT_ENCODERS),
+                        help="Especificaciones formato[:calidad|nivel]")
+    parser.add_argument("--colors", nargs="+", choices=COLOR_MODES, default=["rgb"],
+                        help="Modos de color del render a comparar")
+    args = parser.parse_args(argv)
+
+    doc = fitz.open(args.pdf) if args.pdf else _sample_document(args.pages)
+    pages = range(min(args.pages, doc.page_count))
+
+    print(f"{'dpi':>4}  {'encoder':<14} {'ms/mitad':>9} {'KB/mitad':>9}")
+    for dpi in args.dpi:
+        for color in args.colors:
+            halves = []
+            for page_index in pages:
+                halves.extend(rasterize_halves(doc.load_page(page_index), dpi, color))
+            for spec in args.encoders:
+                try:
+                    encoder = parse_encoder(spec, color)
+                except ValueError:
+                    continue  # combinación no admitida, p. ej. "bilevel" con JPEG o WebP
+                times, sizes = [], []
+                for pix in halves:
+                    start = time.perf_counter()
+                    data = encoder.encode(pix)
+                    times.append(time.perf_counter() - start)
+                    sizes.append(len(data))
+                print(f"{dpi:>4}  {encoder.key:<14} {statistics.median(times) * 1000:>9.1f} "
+                      f"{statistics.mean(sizes) / 1024:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# bench_render.py
+# Suite de benchmark del pipeline de render con PDFs sintéticos generados localmente.
+# Mide apertura + número de páginas, rasterizado de mitades y codificación por DPI, tipo de página y tamaño de mazo.
+# Uso:  python bench_render.py --kinds vector scan cjk --pages 1 100 5000 --output bench.json
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+import fitz  # PyMuPDF
+
+from hanzi_render import RENDER_MODE, content_boxes, parse_encoder, rasterize_halves, render_page_halves
+
+# El mismo rango y paso que el slider de DPI del app
+SLIDER_DPIS = tuple(range(120, 301, 15))
+DEFAULT_PAGES = (1, 100, 1000)
+DEFAULT_ENCODERS = ("png", "jpeg:85", "webp:80")
+PAGE_KINDS = ("vector", "scan", "cjk")
+# Imágenes distintas que se reparten entre las páginas "scan"; con una sola, la caché
+# de imágenes de MuPDF haría que las páginas siguientes parezcan gratis
+_SCAN_VARIANTS = 8
+
+_CJK_SAMPLE = "学习汉字很有意思。你好，我们今天学习新的生词。"
+
+def _scan_images(count: int) -> List[bytes]:
+    """PNGs en escala de grises del tamaño de media página escaneada a 200 DPI, con ruido de papel."""
+    images = []
+    for n in range(count):
+        pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 1170, 1650), False)
+        samples = bytearray(pix.samples_mv)
+        seed = 1103515245 * (n + 1)
+        for i in range(0, len(samples), 7):
+            seed = (seed * 1103515245 + 12345) & 0x7FFFFFFF
+            samples[i] = 200 + (seed >> 24) % 56
+        images.append(fitz.Pixmap(fitz.csGRAY, 1170, 1650, bytes(samples), False).tobytes("png"))
+    return images
+
+def build_document(kind: str, pages: int) -> bytes:
+    """PDF apaisado de `pages` páginas; cada una con contenido a la izquierda y a la derecha."""
+    doc = fitz.open()
+    scans = _scan_images(_SCAN_VARIANTS) if kind == "scan" else []
+    for n in range(pages):
+        page = doc.new_page(width=842, height=595)
+        if kind == "vector":
+            page.insert_text((80, 280), f"Ficha {n + 1}", fontsize=72)
+            page.insert_text((500, 260), "pinyin / significado", fontsize=28)
+            shape = page.new_shape()  # un solo content stream: generar 5000 páginas sigue siendo rápido
+            for k in range(120):
+                shape.draw_bezier((40 + 3 * k, 400), (60 + k, 300), (300 - k, 590), (380 - 2 * k, 560))
+            shape.finish(width=0.4)
+            shape.commit()
+        elif kind == "scan":
+            for half, x0 in enumerate((0, 421)):
+                page.insert_image(fitz.Rect(x0, 0, x0 + 421, 595), stream=scans[(2 * n + half) % len(scans)])
+        elif kind == "cjk":
+            char = chr(0x4E00 + n % 20000)
+            page.insert_text((120, 330), char, fontsize=200, fontname="china-s")
+            page.insert_textbox(fitz.Rect(460, 60, 800, 560), (_CJK_SAMPLE + "\n") * 6,
+                                fontsize=18, fontname="china-s")
+        else:
+            raise ValueError(f"Tipo de página desconocido {kind!r}; usa uno de {PAGE_KINDS}")
+        page.draw_line((421, 0), (421, 595), width=0.5)
+    return doc.tobytes(garbage=3, deflate=True)
+
+def _time(fn: Callable[[], object], repeats: int) -> List[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+def _summary(times: List[float]) -> Dict[str, float]:
+    ordered = sorted(times)
+    return {
+        "n": len(ordered),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+    }
+
+def _sample_pages(total: int, count: int) -> List[int]:
+    """Páginas repartidas por todo el mazo (no solo las primeras, que MuPDF carga antes)."""
+    if total <= count:
+        return list(range(total))
+    return sorted({round(i * (total - 1) / (count - 1)) for i in range(count)})
+
+def _crop_area(page: "fitz.Page") -> float:
+    """Fracción media del área de cada mitad que queda tras el recorte automático."""
+    half_area = page.rect.get_area() / 2
+    return statistics.mean(fitz.Rect(box).get_area() / half_area for box in content_boxes(page))
+
+def bench_deck(kind: str, pages: int, dpis, encoders, samples: int, repeats: int) -> List[dict]:
+    results = []
+    start = time.perf_counter()
+    pdf_bytes = build_document(kind, pages)
+    base = {"kind": kind, "pages": pages, "pdf_bytes": len(pdf_bytes)}
+    print(f"[{kind} x{pages}] generado en {time.perf_counter() - start:.1f} s, "
+          f"{len(pdf_bytes) / 2**20:.1f} MB", file=sys.stderr)
+
+    # get_page_count: abrir el PDF (parseo del xref) y contar páginas
+    def page_count():
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            return doc.page_count
+    results.append({**base, "stage": "get_page_count", **_summary(_time(page_count, repeats))})
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_indices = _sample_pages(doc.page_count, samples)
+        # content_boxes: coste del recorte automático y fracción de la mitad que conserva
+        times, areas = [], []
+        for page_index in page_indices:
+            page = doc.load_page(page_index)
+            times += _time(lambda: areas.append(_crop_area(page)), 1)
+        results.append({**base, "stage": "content_boxes", "crop_area": round(statistics.mean(areas), 3),
+                        **_summary(times)})
+
+        for dpi in dpis:
+            # _render_halves: rasterizado + PNG por defecto, igual que en el app
+            times = []
+            for page_index in page_indices:
+                times += _time(lambda: render_page_halves(doc, page_index, dpi), repeats)
+            results.append({**base, "stage": "render_halves", "dpi": dpi, **_summary(times)})
+
+            halves = []
+            times = []
+            for page_index in page_indices:
+                page = doc.load_page(page_index)
+                times += _time(lambda: halves.append(rasterize_halves(page, dpi)), 1)
+            results.append({**base, "stage": "get_pixmap", "dpi": dpi, **_summary(times)})
+
+            for encoder in encoders:
+                times, sizes = [], []
+                for pair in halves:
+                    for pix in pair:
+                        times += _time(lambda: sizes.append(len(encoder.encode(pix))), 1)
+                results.append({
+                    **base, "stage": "encode", "dpi": dpi, "encoder": encoder.key,
+                    "mean_bytes": round(statistics.mean(sizes)), **_summary(times),
+                })
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de render con PDFs sintéticos.")
+    parser.add_argument("--kinds", nargs="+", choices=PAGE_KINDS, default=list(PAGE_KINDS))
+    parser.add_argument("--pages", type=int, nargs="+", default=list(DEFAULT_PAGES),
+                        help="Tamaños de mazo (1 a 5000 páginas)")
+    parser.add_argument("--dpi", type=int, nargs="+", default=list(SLIDER_DPIS),
+                        help=f"DPI a medir, dentro del rango del slider ({SLIDER_DPIS[0]}–{SLIDER_DPIS[-1]}); "
+                             "por defecto, todas sus posiciones")
+    parser.add_argument("--encoders", nargs="+", default=list(DEFAULT_ENCODERS),
+                        help="Codificadores formato[:calidad|nivel]")
+    parser.add_argument("--samples", type=int, default=5, help="Páginas muestreadas por mazo")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeticiones por medición")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto, stdout)")
+    args = parser.parse_args(argv)
+    outside = [dpi for dpi in args.dpi if not SLIDER_DPIS[0] <= dpi <= SLIDER_DPIS[-1]]
+    if outside:
+        parser.error(f"DPI fuera del rango del slider ({SLIDER_DPIS[0]}–{SLIDER_DPIS[-1]}): {outside}")
+
+    encoders = [parse_encoder(spec) for spec in args.encoders]
+    results = []
+    for kind in args.kinds:
+        for pages in args.pages:
+            results += bench_deck(kind, pages, args.dpi, encoders, args.samples, args.repeats)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "pymupdf": fitz.VersionBind,
+            "platform": platform.platform(),
+            "render_mode": RENDER_MODE,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for row in results:
+        label = " ".join(str(row[k]) for k in ("kind", "pages", "stage", "dpi", "encoder") if k in row)
+        print(f"{label:<40} {row['median_ms']:>10.1f} ms", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+# hanzi_cache.py
+# Cachés de mitades ya renderizadas y codificadas, fuera de la memoria de Streamlit.
+# No depende de Streamlit: la usan el app y las herramientas offline que precalientan mazos.
+# Las cachés compartidas (disco o Redis) ofrecen la misma interfaz: get/put/contains y get_halves/put_halves.
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple, Union
+
+from hanzi_metrics import METRICS
+from hanzi_render import SIDES, ImageEncoder
+
+try:
+    import redis  # opcional: caché compartida entre réplicas en un servidor Redis (o compatible)
+except ImportError:
+    redis = None
+
+# Tras expulsar, se deja la caché en esta fracción del tope para no expulsar en cada escritura
+_EVICT_TARGET = 0.9
+# Espera máxima por una conexión u operación de Redis: con el servidor caído, mejor renderizar que colgarse
+REDIS_SOCKET_TIMEOUT = 2.0
+# Segundos sin consultar una caché compartida tras un error del backend
+SHARED_CACHE_RETRY_AFTER = 30.0
+
+class MemoryCache:
+    """Caché LRU en memoria con presupuesto en bytes para las mitades codificadas.
+
+    A diferencia de `st.cache_data` sin límites, nunca retiene más de
+    `max_bytes`: al insertar se expulsan las entradas menos usadas.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, ...]]" = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def bytes_used(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, ...]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Tuple[bytes, ...]):
+        size = sum(len(part) for part in value)
+        if size > self.max_bytes:
+            return  # no cabe ni sola: mejor no vaciar la caché por ella
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= sum(len(part) for part in old)
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _key, evicted = self._entries.popitem(last=False)
+                self._bytes -= sum(len(part) for part in evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+def memory_cache_from_env() -> MemoryCache:
+    """MemoryCache con HANZI_MEMORY_CACHE_MB de presupuesto (256 por defecto)."""
+    return MemoryCache(int(os.environ.get("HANZI_MEMORY_CACHE_MB", "256")) * 1024 * 1024)
+
+def disk_usage(root: str) -> List[Tuple[float, int, str]]:
+    """(mtime, tamaño, ruta) de cada archivo bajo `root`, sin los temporales (`.tmp`) a medio escribir.
+
+    Un archivo con otros enlaces duros cuenta 0 bytes: borrarlo no libera espacio.
+    """
+    entries = []
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue  # otro proceso la expulsó mientras recorríamos
+            entries.append((st.st_mtime, st.st_size if st.st_nlink == 1 else 0, path))
+    return entries
+
+class BoundedDirectory:
+    """Directorio con tope de tamaño y expulsión LRU, compartible entre procesos.
+
+    El mtime de cada archivo hace de marca LRU (`touch` lo actualiza). Al
+    pasar de `max_bytes` se vuelve a medir el directorio —otros procesos
+    también escriben en él— y se borran los archivos menos usados hasta
+    quedar en `_EVICT_TARGET` del tope, salvo aquellos para los que
+    `keep(path)` es True.
+
+    Un archivo con otros enlaces duros no cuenta para el tope y `touch` no
+    toca su mtime, que es también el del original.
+    """
+
+    def __init__(self, root: str, max_bytes: int, keep: Optional[Callable[[str], bool]] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._keep = keep
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._bytes = sum(size for _mtime, size, _path in disk_usage(root))
+
+    @property
+    def bytes_used(self) -> int:
+        return self._bytes
+
+    def touch(self, path: str) -> bool:
+        """Marca `path` como recién usado; False si ya no existe."""
+        try:
+            if os.stat(path).st_nlink == 1:
+                os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def write(self, path: str, data: bytes):
+        """Escribe `path` de forma atómica (los lectores nunca ven un archivo a medias)."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.added(path, len(data))
+
+    def added(self, path: str, size: int):
+        """Cuenta los `size` bytes de `path`, recién añadido (por `write` o por otra vía).
+
+        Si hay que expulsar, `path` no se expulsa en esta pasada.
+        """
+        with self._lock:
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict_locked(path)
+
+    def _evict_locked(self, added: str):
+        entries = sorted(disk_usage(self.root))
+        total = sum(size for _mtime, size, _path in entries)
+        target = self.max_bytes * _EVICT_TARGET
+        for _mtime, size, path in entries:
+            if total <= target:
+                break
+            if path == added or (self._keep is not None and self._keep(path)):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._bytes = total
+
+class DiskCache:
+    """Caché persistente de mitades renderizadas, con tope de tamaño y expulsión LRU.
+
+    Cada mitad es un archivo `<root>/<doc_id>/<dpi>-<encoder>/<página>-<lado>.<ext>`
+    en un BoundedDirectory, así sobrevive a reinicios y la pueden compartir
+    varios procesos. Cada lectura actualiza la marca LRU del archivo.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._dir = BoundedDirectory(root, max_bytes)
+
+    @property
+    def bytes_used(self) -> int:
+        return self._dir.bytes_used
+
+    def path(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> str:
+        return os.path.join(
+            self.root, doc_id, f"{dpi}-{encoder.key}", f"{page_index:05d}-{side}.{encoder.extension}"
+        )
+
+    def get(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> Optional[bytes]:
+        path = self.path(doc_id, page_index, dpi, encoder, side)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._dir.touch(path)
+        return data
+
+    def put(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str, data: bytes):
+        self._dir.write(self.path(doc_id, page_index, dpi, encoder, side), data)
+
+    def contains(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> bool:
+        return os.path.exists(self.path(doc_id, page_index, dpi, encoder, side))
+
+    def get_halves(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder) -> Optional[Tuple[bytes, bytes]]:
+        left = self.get(doc_id, page_index, dpi, encoder, "left")
+        right = self.get(doc_id, page_index, dpi, encoder, "right") if left is not None else None
+        if right is None:
+            return None
+        return left, right
+
+    def put_halves(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, halves: Tuple[bytes, bytes]):
+        for side, data in zip(SIDES, halves):
+            self.put(doc_id, page_index, dpi, encoder, side, data)
+
+def cache_dir_from_env() -> str:
+    """Directorio de HANZI_CACHE_DIR (por defecto ~/.cache/hanzi_flashcards); "" lo desactiva."""
+    return os.environ.get("HANZI_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "hanzi_flashcards"))
+
+def cache_max_bytes_from_env() -> int:
+    return int(os.environ.get("HANZI_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+def disk_cache_from_env() -> Optional[DiskCache]:
+    """DiskCache según HANZI_CACHE_DIR / HANZI_CACHE_MAX_MB; None si la caché en disco está desactivada."""
+    root = cache_dir_from_env()
+    if not root:
+        return None
+    return DiskCache(root, cache_max_bytes_from_env())
+
+class RedisCache:
+    """Caché de mitades renderizadas en un servidor Redis (o compatible: Valkey, KeyDB…).
+
+    Todas las réplicas del app detrás del balanceador apuntan al mismo servidor,
+    así cada página se renderiza una sola vez en todo el despliegue. El tope de
+    memoria y la expulsión los pone el servidor (`maxmemory` con
+    `maxmemory-policy allkeys-lru`); `ttl` opcional en segundos. `client`
+    sustituye al cliente creado desde `url` (p. ej. fakeredis en las pruebas).
+    """
+
+    def __init__(self, url: str, prefix: str = "hanzi", ttl: Optional[int] = None, client=None):
+        self.prefix = prefix
+        self.ttl = ttl
+        if client is None:
+            if redis is None:
+                raise RuntimeError("La caché en Redis requiere redis-py. Instálalo con:  pip install redis")
+            client = redis.Redis.from_url(
+                url, socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT
+            )
+        self._client = client
+
+    def key(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> str:
+        return f"{self.prefix}:{doc_id}:{dpi}-{encoder.key}:{page_index:05d}-{side}"
+
+    def get(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> Optional[bytes]:
+        return self._client.get(self.key(doc_id, page_index, dpi, encoder, side))
+
+    def put(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str, data: bytes):
+        self._client.set(self.key(doc_id, page_index, dpi, encoder, side), data, ex=self.ttl)
+
+    def contains(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> bool:
+        return bool(self._client.exists(self.key(doc_id, page_index, dpi, encoder, side)))
+
+    def get_halves(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder) -> Optional[Tuple[bytes, bytes]]:
+        left, right = self._client.mget([self.key(doc_id, page_index, dpi, encoder, side) for side in SIDES])
+        if left is None or right is None:
+            return None
+        return left, right
+
+    def put_halves(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, halves: Tuple[bytes, bytes]):
+        pipe = self._client.pipeline(transaction=False)
+        for side, data in zip(SIDES, halves):
+            pipe.set(self.key(doc_id, page_index, dpi, encoder, side), data, ex=self.ttl)
+        pipe.execute()
+
+SharedCache = Union[DiskCache, RedisCache]
+
+# Errores de backend que no deben tumbar el app: E/S de disco (lleno, permisos) y Redis caído o lento
+_BACKEND_ERRORS = (OSError,) if redis is None else (OSError, redis.RedisError)
+
+class FailSafeCache:
+    """Envuelve una caché compartida para que un fallo del backend no tumbe el app.
+
+    Un error de E/S o de Redis cuenta como fallo de caché (`get` da None,
+    `contains` da False, `put` no guarda nada) y suma "shared_cache_error";
+    el app sigue renderizando. Tras un error no se vuelve a consultar el
+    backend durante `retry_after` segundos, así una caída no añade el plazo
+    de conexión a cada petición.
+    """
+
+    def __init__(self, cache: SharedCache, retry_after: float = SHARED_CACHE_RETRY_AFTER):
+        self.cache = cache
+        self.retry_after = retry_after
+        self._down_until = 0.0
+
+    def get(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> Optional[bytes]:
+        return self._guard(None, self.cache.get, doc_id, page_index, dpi, encoder, side)
+
+    def put(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str, data: bytes):
+        self._guard(None, self.cache.put, doc_id, page_index, dpi, encoder, side, data)
+
+    def contains(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> bool:
+        return self._guard(False, self.cache.contains, doc_id, page_index, dpi, encoder, side)
+
+    def get_halves(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder) -> Optional[Tuple[bytes, bytes]]:
+        return self._guard(None, self.cache.get_halves, doc_id, page_index, dpi, encoder)
+
+    def put_halves(self, doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, halves: Tuple[bytes, bytes]):
+        self._guard(None, self.cache.put_halves, doc_id, page_index, dpi, encoder, halves)
+
+    def _guard(self, default, fn, *args):
+        if time.monotonic() < self._down_until:
+            METRICS.incr("shared_cache_skipped")
+            return default
+        try:
+            return fn(*args)
+        except _BACKEND_ERRORS:
+            METRICS.incr("shared_cache_error")
+            self._down_until = time.monotonic() + self.retry_after
+            return default
+
+def shared_cache_from_env() -> Optional[SharedCache]:
+    """Caché compartida según HANZI_CACHE_BACKEND: "disk" (por defecto, ver `disk_cache_from_env`) o "redis".
+
+    Con "redis" se usan HANZI_REDIS_URL (redis://localhost:6379/0 por defecto) y HANZI_REDIS_TTL.
+    Para compartir la de disco entre réplicas basta con que HANZI_CACHE_DIR sea un volumen común.
+    """
+    backend = os.environ.get("HANZI_CACHE_BACKEND", "disk").strip().lower()
+    if backend == "disk":
+        return disk_cache_from_env()
+    if backend == "redis":
+        ttl = os.environ.get("HANZI_REDIS_TTL")
+        return RedisCache(os.environ.get("HANZI_REDIS_URL", "redis://localhost:6379/0"), ttl=int(ttl) if ttl else None)
+    raise ValueError(f"HANZI_CACHE_BACKEND debe ser 'disk' o 'redis', no {backend!r}")
@@ -0,0 +1,195 @@
+# hanzi_decks.py
+# Almacén de mazos en disco direccionado por contenido, compartido por sesiones y procesos,
+# y biblioteca de mazos comunes que se eligen de una lista en lugar de subirlos.
+# No depende de Streamlit: lo usan el app, los procesos de render y las herramientas offline.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import fitz  # PyMuPDF
+
+from hanzi_cache import BoundedDirectory
+from hanzi_render import file_document_id, open_mapped_document, spool_document
+
+class DeckStore:
+    """Cada mazo se guarda una sola vez como `<root>/<doc_id>.pdf`.
+
+    Si 40 estudiantes suben el mismo PDF, todos obtienen el mismo `doc_id`:
+    un solo archivo, abierto por mmap (la memoria la pone una única vez la
+    caché de páginas del sistema) y las mismas entradas en las cachés de render.
+
+    El directorio es un BoundedDirectory de `max_bytes`: al pasarse, se borran
+    los mazos usados hace más tiempo, salvo los protegidos con `protect` (los
+    de la biblioteca) y los que `in_use` da por abiertos.
+    """
+
+    def __init__(self, root: str, max_bytes: int, in_use: Optional[Callable[[str], bool]] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._in_use = in_use
+        self._protected: Set[str] = set()
+        self._dir = BoundedDirectory(root, max_bytes, keep=self._keep)
+
+    def path(self, doc_id: str) -> str:
+        return os.path.join(self.root, f"{doc_id}.pdf")
+
+    def __contains__(self, doc_id: str) -> bool:
+        return os.path.exists(self.path(doc_id))
+
+    def protect(self, doc_ids: Iterable[str]):
+        """Excluye `doc_ids` de la expulsión; sustituye a la lista protegida anterior."""
+        self._protected = set(doc_ids)
+
+    def _keep(self, path: str) -> bool:
+        name = os.path.basename(path)
+        if not name.endswith(".pdf"):
+            return True  # library.json y demás archivos que no son mazos
+        doc_id = name[:-len(".pdf")]
+        return doc_id in self._protected or (self._in_use is not None and self._in_use(doc_id))
+
+    def add_stream(self, fileobj: BinaryIO) -> str:
+        """Vuelca un archivo abierto (p. ej. una subida) al almacén; devuelve su doc_id."""
+        doc_id, path = spool_document(fileobj, self.root)
+        self._added(path)
+        return doc_id
+
+    def add_file(self, path: str, protected: bool = False) -> str:
+        """Añade una copia de un PDF existente; devuelve su doc_id.
+
+        Copia y no enlace duro: si alguien sobrescribe el original en su sitio
+        (`cp nuevo.pdf hsk1.pdf`), el mazo direccionado por contenido no cambia
+        bajo los mmap abiertos. Un enlace duro que dejó una versión anterior se
+        sustituye por una copia. Con `protected`, el mazo queda protegido antes
+        de contarlo en el tope.
+        """
+        doc_id = file_document_id(path)
+        target = self.path(doc_id)
+        if not self.has_copy(doc_id):
+            tmp_path = os.path.join(self.root, f"{doc_id}.{os.getpid()}.tmp")
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, target)
+        if protected:
+            self._protected = self._protected | {doc_id}
+        self._added(target)
+        return doc_id
+
+    def has_copy(self, doc_id: str) -> bool:
+        """True si el mazo está en el almacén como archivo propio (no un enlace duro a otro)."""
+        try:
+            return os.stat(self.path(doc_id)).st_nlink == 1
+        except FileNotFoundError:
+            return False
+
+    def _added(self, path: str):
+        # Si el mazo ya estaba se cuenta de más; la expulsión vuelve a medir el directorio
+        self._dir.touch(path)
+        st = os.stat(path)
+        self._dir.added(path, st.st_size if st.st_nlink == 1 else 0)  # un enlace duro no ocupa más
+
+    def open(self, doc_id: str) -> Tuple["fitz.Document", int]:
+        """Abre el mazo por mmap; sirve como `opener` de DocumentPool."""
+        path = self.path(doc_id)
+        self._dir.touch(path)  # marca de uso para el LRU
+        return open_mapped_document(path)
+
+def deck_dir_from_env() -> str:
+    """Directorio de HANZI_DECK_DIR (por defecto `hanzi_flashcards/decks` en el directorio temporal).
+
+    No debe estar dentro de HANZI_CACHE_DIR: la caché en disco expulsaría los mazos.
+    """
+    return os.environ.get("HANZI_DECK_DIR", os.path.join(tempfile.gettempdir(), "hanzi_flashcards", "decks"))
+
+def deck_store_from_env(in_use: Optional[Callable[[str], bool]] = None) -> DeckStore:
+    """DeckStore en `deck_dir_from_env()` con tope HANZI_DECK_MAX_MB (4096 por defecto)."""
+    max_bytes = int(os.environ.get("HANZI_DECK_MAX_MB", "4096")) * 1024 * 1024
+    return DeckStore(deck_dir_from_env(), max_bytes, in_use)
+
+class LibraryDeck(NamedTuple):
+    """Un PDF de la biblioteca del servidor, ya indexado."""
+    name: str
+    path: str
+    doc_id: str
+    page_count: int
+
+class DeckLibrary:
+    """Mazos comunes (p. ej. los de HSK) en un directorio del servidor, sin pasar por la subida.
+
+    `scan` indexa cada PDF (hash y número de páginas) y lo copia en el
+    DeckStore, así comparte doc_id y cachés con una subida del mismo archivo.
+    El índice se guarda en `<store>/library.json`: un PDF cuyo tamaño y mtime
+    no han cambiado no se vuelve a hashear ni abrir en el siguiente arranque.
+    """
+
+    def __init__(self, root: str, store: DeckStore):
+        self.root = root
+        self.store = store
+        self._index_path = os.path.join(store.root, "library.json")
+        self._lock = threading.Lock()
+        self._decks: Dict[str, LibraryDeck] = {}
+
+    @property
+    def decks(self) -> List[LibraryDeck]:
+        with self._lock:
+            return sorted(self._decks.values(), key=lambda deck: deck.name.lower())
+
+    def get(self, name: str) -> Optional[LibraryDeck]:
+        with self._lock:
+            return self._decks.get(name)
+
+    def scan(self) -> List[LibraryDeck]:
+        """Vuelve a recorrer el directorio y devuelve los mazos encontrados."""
+        index = self._load_index()
+        # Se protege ya lo indexado: si un mazo nuevo pasa el tope, no se expulsan los demás
+        self.store.protect(entry["doc_id"] for entry in index.values())
+        decks: Dict[str, LibraryDeck] = {}
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.lower().endswith(".pdf"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root)
+                try:
+                    st = os.stat(path)
+                    stamp = [st.st_size, st.st_mtime_ns]
+                    cached = index.get(name)
+                    if cached is not None and cached["stamp"] == stamp and self.store.has_copy(cached["doc_id"]):
+                        doc_id, page_count = cached["doc_id"], cached["page_count"]
+                    else:
+                        doc_id = self.store.add_file(path, protected=True)
+                        with fitz.open(path) as doc:
+                            page_count = doc.page_count
+                except (OSError, RuntimeError):
+                    continue  # ilegible o no es un PDF válido: no se ofrece
+                index[name] = {"stamp": stamp, "doc_id": doc_id, "page_count": page_count}
+                decks[name] = LibraryDeck(name, path, doc_id, page_count)
+        self._save_index({name: index[name] for name in decks})
+        self.store.protect(deck.doc_id for deck in decks.values())
+        with self._lock:
+            self._decks = decks
+        return self.decks
+
+    def _load_index(self) -> Dict[str, dict]:
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_index(self, index: Dict[str, dict]):
+        tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._index_path)
+
+def deck_library_from_env(store: DeckStore) -> Optional[DeckLibrary]:
+    """DeckLibrary ya escaneada sobre HANZI_LIBRARY_DIR; None si no está definida."""
+    root = os.environ.get("HANZI_LIBRARY_DIR")
+    if not root:
+        return None
+    library = DeckLibrary(root, store)
+    library.scan()
+    return library
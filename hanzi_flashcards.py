@@ -3,26 +3,75 @@
 # Muestra primero la mitad izquierda (carácter/contexto) y, al hacer clic, revela la derecha (pinyin/significado).
 # Ejecutar local:  streamlit run hanzi_flashcards.py
 
+import os
 import random
-from typing import Tuple
+import threading
+import time
+import uuid
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple, TypeVar
 
 import streamlit as st
 
+_rerun_start = time.perf_counter()
+
 try:
     import fitz  # PyMuPDF
 except Exception:
     st.error("PyMuPDF (fitz) is required. Please install with:  pip install pymupdf")
     raise
 
+try:
+    from streamlit_js_eval import streamlit_js_eval  # opcional: lee el tamaño de la ventana del navegador
+except ImportError:
+    streamlit_js_eval = None
+
+from hanzi_cache import FailSafeCache, MemoryCache, memory_cache_from_env, shared_cache_from_env
+from hanzi_decks import DeckLibrary, DeckStore, deck_library_from_env, deck_store_from_env
+from hanzi_metrics import METRICS
+from hanzi_render import (
+    RENDER_TIERS, SIDES, CropBoxCache, DocumentPool, ImageEncoder, RenderTimeout, RenderWatchdog, SingleFlight,
+    downscale_encoded, dpi_for_width, encoded_width, encoder_from_env, render_page_half, render_page_halves, render_tier,
+    render_timeout_from_env,
+)
+from hanzi_scheduler import PRIORITY_NEXT, PRIORITY_PREFETCH, PRIORITY_VISIBLE, RenderScheduler
+from hanzi_static import ImageServer, image_server_from_env
+from hanzi_workers import ProcessRenderer, process_renderer_from_env
+
+T = TypeVar("T")
+
+# Hilos del planificador que renderizan en segundo plano (precarga de las próximas tarjetas)
+PREFETCH_WORKERS = 2
+# Slider de DPI (mínimo, máximo, paso): con paso 15 desde 120 pasa por los niveles 150, 225 y 300
+# de la pirámide, y el valor por defecto es uno de ellos (sin reducción ni recodificación)
+DPI_SLIDER = (120, 300, 15)
+DEFAULT_DPI = 225
+# Resolución del borrador que se muestra mientras se renderiza la página al DPI elegido
+PREVIEW_DPI = RENDER_TIERS[0]
+# Por debajo de este ancho (px CSS) Streamlit apila las columnas y cada mitad ocupa toda la pantalla
+STACKED_COLUMNS_MAX_WIDTH = 640
+# Márgenes horizontales aproximados del contenido en layout "wide" (px CSS)
+PAGE_PADDING_PX = {"stacked": 32, "wide": 160}
+
 st.set_page_config(page_title="Hanzi Flashcards (PDF → left/right)", layout="wide")
 
 st.title("🀄 Hanzi Flashcards desde PDF")
 st.caption("Sube tu PDF de fichas. El app mostrará **solo el lado izquierdo** primero; haz clic para ver el derecho.")
 
 with st.expander("⚙️ Opciones", expanded=False):
+    auto_dpi = st.checkbox(
+        "Resolución automática según la pantalla", value=streamlit_js_eval is not None,
+        disabled=streamlit_js_eval is None,
+        help="Ajusta el render al ancho real de la columna y a la densidad de píxeles del dispositivo: "
+             "los móviles no descargan imágenes enormes para luego reducirlas."
+             + ("" if streamlit_js_eval is not None else "  Requiere:  pip install streamlit-js-eval")
+    )
     dpi = st.slider(
-        "Resolución de render (DPI)", min_value=120, max_value=300, value=200, step=20,
-        help="Más DPI = imagen más nítida (y más lenta). 200 es un buen balance."
+        "Resolución de render (DPI)", min_value=DPI_SLIDER[0], max_value=DPI_SLIDER[1], value=DEFAULT_DPI,
+        step=DPI_SLIDER[2], disabled=auto_dpi,
+        help=f"Más DPI = imagen más nítida (y más lenta). {DEFAULT_DPI} es un buen balance; "
+             f"{', '.join(str(tier) for tier in RENDER_TIERS[1:])} se renderizan directamente, "
+             "el resto se reduce del nivel superior."
     )
     no_repeats = st.checkbox(
         "Barajar todas las páginas sin repetición", value=True,
@@ -33,36 +82,428 @@ with st.expander("⚙️ Opciones", expanded=False):
         "Mantener respuesta visible al pasar a la siguiente", value=False,
         help="Si se desactiva, cada tarjeta nueva vuelve a ocultar la respuesta."
     )
+    progressive = st.checkbox(
+        "Render progresivo", value=True,
+        help="En páginas que aún no están en caché, muestra al instante un borrador a baja resolución "
+             "y lo sustituye por la imagen nítida en cuanto está lista."
+    )
+    prefetch_count = st.slider(
+        "Tarjetas a precargar", min_value=0, max_value=10, value=3,
+        help="Renderiza en segundo plano las próximas tarjetas del orden barajado para que el cambio sea inmediato."
+    )
+    prefetch_answers = st.checkbox(
+        "Precargar también las respuestas", value=False,
+        help="Si se desactiva, el lado derecho solo se renderiza al pulsar “Mostrar Respuesta”: "
+             "las tarjetas que se saltan no cuestan nada."
+    )
+    show_debug = st.checkbox(
+        "Panel de depuración", value=False,
+        help="Muestra en la barra lateral el tiempo de cada etapa del render y los aciertos de caché."
+    )
+
+class DocumentRegistry:
+    """Recuerda qué doc_id corresponde a cada subida, para no volver a hashearla.
+
+    Las funciones cacheadas reciben el ID corto en lugar de los bytes, así
+    `st.cache_data` no vuelve a hashear cientos de MB en cada rerun. La subida
+    se vuelca por bloques al DeckStore, donde un PDF idéntico subido por otra
+    sesión (u otro proceso) ya ocupa el mismo archivo.
+    """
+
+    def __init__(self, store: DeckStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._ids: Dict[Tuple[str, int], str] = {}  # (file_id, tamaño) -> doc_id
+
+    def register(self, uploaded) -> str:
+        """Devuelve el doc_id de un archivo subido; solo lo lee y hashea la primera vez."""
+        upload_key = (getattr(uploaded, "file_id", None) or uploaded.name, uploaded.size)
+        with self._lock:
+            doc_id = self._ids.get(upload_key)
+            if doc_id is not None and doc_id in self.store:
+                return doc_id
+        with METRICS.timer("upload_spool"):
+            uploaded.seek(0)
+            doc_id = self.store.add_stream(uploaded)
+            uploaded.seek(0)
+        with self._lock:
+            self._ids[upload_key] = doc_id
+        return doc_id
+
+@st.cache_resource(show_spinner=False)
+def get_deck_store() -> DeckStore:
+    # Directorio HANZI_DECK_DIR, compartido por todos los procesos (y réplicas) del host.
+    # Los mazos abiertos en el pool de este proceso no se expulsan
+    return deck_store_from_env(in_use=lambda doc_id: get_document_pool().is_open(doc_id))
+
+@st.cache_resource(show_spinner="Indexando la biblioteca de mazos…")
+def get_deck_library() -> Optional[DeckLibrary]:
+    # Con HANZI_LIBRARY_DIR se ofrecen los mazos del servidor; se indexan una vez por proceso
+    return deck_library_from_env(get_deck_store())
+
+@st.cache_resource(show_spinner=False)
+def get_document_registry() -> DocumentRegistry:
+    # Un único registro por proceso, compartido por todas las sesiones
+    return DocumentRegistry(get_deck_store())
+
+@st.cache_resource(show_spinner=False)
+def get_document_pool() -> DocumentPool:
+    # Los mazos se abren por mmap: procesos que abren el mismo archivo comparten sus páginas
+    return DocumentPool(get_deck_store().open)
+
+@st.cache_resource(show_spinner=False)
+def get_image_encoder() -> ImageEncoder:
+    # Se elige por despliegue con HANZI_IMAGE_FORMAT / HANZI_IMAGE_QUALITY / HANZI_PNG_LEVEL
+    return encoder_from_env()
+
+@st.cache_resource(show_spinner=False)
+def get_memory_cache() -> MemoryCache:
+    # Presupuesto fijo en bytes (HANZI_MEMORY_CACHE_MB) compartido por todas las sesiones
+    return memory_cache_from_env()
+
+@st.cache_resource(show_spinner=False)
+def get_shared_cache() -> Optional[FailSafeCache]:
+    # Sobrevive a reinicios y la comparten procesos y réplicas: disco (HANZI_CACHE_DIR, "" la desactiva)
+    # o Redis (HANZI_CACHE_BACKEND=redis). Si el backend falla, cuenta como fallo de caché y se renderiza
+    cache = shared_cache_from_env()
+    return FailSafeCache(cache) if cache is not None else None
+
+@st.cache_resource(show_spinner=False)
+def get_process_renderer() -> Optional[ProcessRenderer]:
+    # Con HANZI_RENDER_WORKERS > 0 los renders se reparten entre procesos
+    return process_renderer_from_env()
+
+@st.cache_resource(show_spinner=False)
+def get_render_watchdog() -> Optional[RenderWatchdog]:
+    # Plazo por página (HANZI_RENDER_TIMEOUT). Solo con procesos de render (HANZI_RENDER_WORKERS > 0) un render
+    # colgado se mata y se reinicia; en el propio proceso se deja de esperar y se sigue con otro documento
+    timeout = render_timeout_from_env()
+    return RenderWatchdog(timeout) if timeout is not None else None
+
+@st.cache_resource(show_spinner=False)
+def get_render_flights() -> SingleFlight:
+    # Renders en curso en este proceso: las peticiones simultáneas de la misma página esperan al primero
+    return SingleFlight()
+
+@st.cache_resource(show_spinner=False)
+def get_image_server() -> Optional[ImageServer]:
+    # Con HANZI_IMAGE_PORT / HANZI_IMAGE_BASE_URL las imágenes se sirven por URL cacheable
+    return image_server_from_env()
+
+def image_source(data: bytes, encoder: ImageEncoder):
+    """Lo que se pasa a `st.image`: la URL estática de la imagen o, sin servidor, los propios bytes."""
+    server = get_image_server()
+    if server is None:
+        return data
+    return server.url_for(data, encoder)
+
+def _watched(key: tuple, render: Callable[[], T]) -> T:
+    """Ejecuta en un proceso de render `render`, que aplica el plazo; la clave queda en cuarentena si lo supera."""
+    watchdog = get_render_watchdog()
+    if watchdog is None:
+        return render()
+    return watchdog.run(key, render)
+
+def _watched_in_thread(key: tuple, doc_id: str, render: Callable[["fitz.Document"], T]) -> T:
+    """Ejecuta `render(doc)` en este proceso bajo el watchdog; lanza RenderTimeout si supera el plazo.
+
+    El plazo cuenta desde que se obtiene el documento. Si se agota, el documento
+    se aparta del pool (el hilo colgado lo retiene) y las demás páginas y el
+    borrador siguen con otro; la siguiente petición con la misma `key` recoge
+    el resultado del render en curso.
+    """
+    pool = get_document_pool()
+    watchdog = get_render_watchdog()
+    if watchdog is None:
+        with pool.document(doc_id) as doc:
+            return render(doc)
+    return watchdog.run_in_thread(key, render, hold=lambda: pool.document(doc_id),
+                                  on_timeout=lambda doc: pool.detach(doc_id, doc))
+
+@st.cache_resource(show_spinner=False)
+def get_crop_box_cache() -> CropBoxCache:
+    # En puntos de PDF: valen para cualquier DPI, así que se calculan una sola vez por página
+    return CropBoxCache()
+
+def _render_halves(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder) -> Tuple[bytes, bytes]:
+    """Devuelve (left_bytes, right_bytes) codificados para un índice de página dado."""
+    key = (doc_id, page_index, dpi, encoder.key)
+    renderer = get_process_renderer()
+    if renderer is not None:
+        path = get_deck_store().path(doc_id)
+        return _watched(key, lambda: renderer.render(doc_id, path, page_index, dpi, encoder))
+
+    def render(doc: "fitz.Document") -> Tuple[bytes, bytes]:
+        # Las cajas de recorte se calculan aquí, dentro del plazo del watchdog
+        crop = get_crop_box_cache().get(doc_id, doc, page_index) if encoder.crop else None
+        return render_page_halves(doc, page_index, dpi, encoder, crop)
+    return _watched_in_thread(key, doc_id, render)
 
-uploaded = st.file_uploader("📄 Sube el PDF (cada página contiene izquierda/derecha)", type=["pdf"])
+def _render_half(doc_id: str, page_index: int, dpi: int, side: str, encoder: ImageEncoder) -> bytes:
+    """Como `_render_halves`, pero rasteriza y codifica solo una mitad."""
+    key = (doc_id, page_index, dpi, encoder.key, side)
+    renderer = get_process_renderer()
+    if renderer is not None:
+        path = get_deck_store().path(doc_id)
+        return _watched(key, lambda: renderer.render_half(doc_id, path, page_index, dpi, side, encoder))
 
-def _render_halves(pdf_bytes: bytes, page_index: int, dpi: int) -> Tuple[bytes, bytes]:
-    """Devuelve (left_png_bytes, right_png_bytes) para un índice de página dado."""
-    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-        page = doc.load_page(page_index)
-        rect = page.rect
-        mid_x = rect.x0 + rect.width / 2.0
-        left_rect = fitz.Rect(rect.x0, rect.y0, mid_x, rect.y1)
-        right_rect = fitz.Rect(mid_x, rect.y0, rect.x1, rect.y1)
+    def render(doc: "fitz.Document") -> bytes:
+        crop = get_crop_box_cache().get(doc_id, doc, page_index)[SIDES.index(side)] if encoder.crop else None
+        return render_page_half(doc, page_index, dpi, side, encoder, crop)
+    return _watched_in_thread(key, doc_id, render)
 
-        scale = dpi / 72.0  # 72 dpi base en PDF
-        mat = fitz.Matrix(scale, scale)
+def get_half_or_fallback(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder,
+                         side: str) -> Optional[Tuple[bytes, int]]:
+    """Como `get_half_cached`, pero si la página supera el plazo prueba a baja resolución; None si tampoco.
 
-        left_pix = page.get_pixmap(matrix=mat, clip=left_rect, alpha=False)
-        right_pix = page.get_pixmap(matrix=mat, clip=right_rect, alpha=False)
-        return left_pix.tobytes("png"), right_pix.tobytes("png")
+    Devuelve la imagen y el DPI al que se obtuvo.
+    """
+    try:
+        return get_half_cached(doc_id, page_index, dpi, encoder, side), dpi
+    except RenderTimeout:
+        if dpi <= PREVIEW_DPI:
+            return None
+    METRICS.incr("render_fallback")
+    try:
+        return get_half_cached(doc_id, page_index, PREVIEW_DPI, encoder, side), PREVIEW_DPI
+    except RenderTimeout:
+        return None
 
-@st.cache_data(show_spinner=False)
-def get_page_count(pdf_bytes: bytes) -> int:
-    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_page_count(doc_id: str) -> int:
+    with get_document_pool().document(doc_id) as doc:
         return doc.page_count
 
-@st.cache_data(show_spinner=False)
-def get_halves_cached(pdf_bytes: bytes, page_index: int, dpi: int) -> Tuple[bytes, bytes]:
-    # Cachea por (bytes, índice, dpi) para que la navegación sea rápida
-    return _render_halves(pdf_bytes, page_index, dpi)
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_page_width(doc_id: str) -> float:
+    # Ancho en puntos de la primera página; los mazos suelen tener todas las páginas iguales
+    with get_document_pool().document(doc_id) as doc:
+        return doc.load_page(0).rect.width
+
+def client_viewport() -> Optional[Tuple[int, float]]:
+    """(ancho de la ventana en px CSS, devicePixelRatio) del navegador; None hasta que responde."""
+    if streamlit_js_eval is None:
+        return None
+    value = streamlit_js_eval(js_expressions="[window.innerWidth, window.devicePixelRatio]", key="viewport")
+    if not value:
+        return None
+    return int(value[0]), float(value[1] or 1.0)
+
+def viewport_dpi(page_width_pt: float, viewport: Tuple[int, float]) -> int:
+    """El nivel de la pirámide cuyas mitades cubren la columna a la densidad del dispositivo.
+
+    Se usa el nivel tal cual (sin reducirlo al DPI exacto): así solo hay unos
+    pocos tamaños en caché, y cada cliente recibe el más pequeño que le basta.
+    """
+    width, ratio = viewport
+    if width < STACKED_COLUMNS_MAX_WIDTH:
+        column_px = width - PAGE_PADDING_PX["stacked"]
+    else:
+        column_px = (width - PAGE_PADDING_PX["wide"]) / 2
+    needed = dpi_for_width(page_width_pt, round(max(column_px, 1) * ratio))
+    return render_tier(min(max(needed, RENDER_TIERS[1]), RENDER_TIERS[-1]))
+
+def _shared_cache_for(dpi: int) -> Optional[FailSafeCache]:
+    """La caché compartida para mitades a `dpi`; None para los borradores, que solo viven en memoria."""
+    # Un borrador cuesta poco de renderizar y solo se ve un instante: no merece ocupar disco ni Redis
+    return None if dpi == PREVIEW_DPI else get_shared_cache()
+
+def lookup_half_cached(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> Optional[bytes]:
+    """La mitad `side` si ya está en alguna caché; None si habría que renderizarla."""
+    # Primero la caché en memoria (acotada en bytes); debajo, la compartida (disco o Redis), que sobrevive a reinicios.
+    key = (doc_id, page_index, dpi, encoder.key, side)
+    memory = get_memory_cache()
+    entry = memory.get(key)
+    if entry is not None:
+        METRICS.incr("memory_cache_hit")
+        return entry[0]
+    METRICS.incr("memory_cache_miss")
+    tier = render_tier(dpi)
+    if tier != dpi:
+        # DPI fuera de la pirámide: basta con tener el nivel superior para reducirlo
+        source = lookup_half_cached(doc_id, page_index, tier, encoder, side)
+        if source is None:
+            return None
+        return _derive_half(key, source, dpi / tier, encoder)
+    shared = _shared_cache_for(dpi)
+    if shared is None:
+        return None
+    data = shared.get(doc_id, page_index, dpi, encoder, side)
+    METRICS.incr("shared_cache_miss" if data is None else "shared_cache_hit")
+    if data is not None:
+        memory.put(key, (data,))
+    return data
+
+def _derive_half(key: tuple, source: bytes, factor: float, encoder: ImageEncoder) -> bytes:
+    # Las reducciones solo se guardan en memoria: en la caché compartida viven únicamente los niveles de la pirámide
+    data = downscale_encoded(source, factor, encoder)
+    METRICS.incr("pyramid_downscale")
+    get_memory_cache().put(key, (data,))
+    return data
+
+def is_half_cached(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> bool:
+    """Como `lookup_half_cached`, pero sin leer la imagen ni contar aciertos."""
+    if get_memory_cache().get((doc_id, page_index, dpi, encoder.key, side)) is not None:
+        return True
+    dpi = render_tier(dpi)
+    if get_memory_cache().get((doc_id, page_index, dpi, encoder.key, side)) is not None:
+        return True
+    shared = _shared_cache_for(dpi)
+    return shared is not None and shared.contains(doc_id, page_index, dpi, encoder, side)
+
+def _store_half(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str, data: bytes):
+    shared = _shared_cache_for(dpi)
+    if shared is not None:
+        shared.put(doc_id, page_index, dpi, encoder, side, data)
+    get_memory_cache().put((doc_id, page_index, dpi, encoder.key, side), (data,))
+
+def get_half_cached(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> bytes:
+    # Cachea por (hash del documento, índice, dpi, codificador, lado) para que la navegación sea rápida.
+    data = lookup_half_cached(doc_id, page_index, dpi, encoder, side)
+    if data is None:
+        tier = render_tier(dpi)
+        if tier != dpi:
+            source = get_half_cached(doc_id, page_index, tier, encoder, side)
+            return _derive_half((doc_id, page_index, dpi, encoder.key, side), source, dpi / tier, encoder)
+        data = get_render_flights().do(
+            (doc_id, page_index, dpi, encoder.key, side),
+            lambda: _render_and_store_half(doc_id, page_index, dpi, encoder, side),
+        )
+    return data
+
+def _recheck_half(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> Optional[bytes]:
+    # Ya dentro del vuelo: otro render pudo dejar la mitad en caché después de la consulta (sin contar aciertos)
+    key = (doc_id, page_index, dpi, encoder.key, side)
+    entry = get_memory_cache().get(key)
+    if entry is not None:
+        return entry[0]
+    shared = _shared_cache_for(dpi)
+    data = shared.get(doc_id, page_index, dpi, encoder, side) if shared is not None else None
+    if data is not None:
+        get_memory_cache().put(key, (data,))
+    return data
+
+def _render_and_store_half(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder, side: str) -> bytes:
+    page = get_render_flights().pending((doc_id, page_index, dpi, encoder.key))
+    if page is not None:
+        # Se está renderizando la página completa: su resultado trae las dos mitades
+        METRICS.incr("render_coalesced")
+        return page.result()[SIDES.index(side)]
+    data = _recheck_half(doc_id, page_index, dpi, encoder, side)
+    if data is not None:
+        return data
+    with METRICS.timer("render"):
+        data = _render_half(doc_id, page_index, dpi, side, encoder)
+    METRICS.incr(f"render_{side}")
+    _store_half(doc_id, page_index, dpi, encoder, side, data)
+    return data
+
+def _render_and_store_halves(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder) -> Tuple[bytes, bytes]:
+    left, right = (_recheck_half(doc_id, page_index, dpi, encoder, side) for side in SIDES)
+    if left is not None and right is not None:
+        return left, right
+    with METRICS.timer("render"):
+        halves = _render_halves(doc_id, page_index, dpi, encoder)
+    for side, data in zip(SIDES, halves):
+        METRICS.incr(f"render_{side}")
+        _store_half(doc_id, page_index, dpi, encoder, side, data)
+    return halves
+
+def get_halves_cached(doc_id: str, page_index: int, dpi: int, encoder: ImageEncoder) -> Tuple[bytes, bytes]:
+    """Las dos mitades; si faltan ambas se rasteriza la página una sola vez."""
+    tier = render_tier(dpi)
+    if tier != dpi:
+        get_halves_cached(doc_id, page_index, tier, encoder)  # el nivel, en una sola pasada si hace falta
+        left, right = (get_half_cached(doc_id, page_index, dpi, encoder, side) for side in SIDES)
+        return left, right
+    left = lookup_half_cached(doc_id, page_index, dpi, encoder, "left")
+    right = lookup_half_cached(doc_id, page_index, dpi, encoder, "right")
+    if left is None and right is None:
+        return get_render_flights().do(
+            (doc_id, page_index, dpi, encoder.key),
+            lambda: _render_and_store_halves(doc_id, page_index, dpi, encoder),
+        )
+    if left is None:
+        left = get_half_cached(doc_id, page_index, dpi, encoder, "left")
+    if right is None:
+        right = get_half_cached(doc_id, page_index, dpi, encoder, "right")
+    return left, right
+
+@st.cache_resource(show_spinner=False)
+def get_render_scheduler() -> RenderScheduler:
+    # Un solo planificador por proceso: los trabajos de todas las sesiones compiten por los mismos hilos
+    return RenderScheduler(PREFETCH_WORKERS)
+
+def session_key() -> str:
+    """Identifica a esta sesión como grupo de trabajos en el planificador."""
+    if "session_key" not in st.session_state:
+        st.session_state.session_key = uuid.uuid4().hex
+    return st.session_state.session_key
+
+def upcoming_indices(count: int):
+    """Las próximas `count` páginas que devolverá `next_index` en modo sin repetición."""
+    order = st.session_state.get("order", [])
+    pos = st.session_state.get("pos", 0)
+    return order[pos:pos + count]
+
+def schedule_warmup(doc_id: str, dpi: int, encoder: ImageEncoder, count: int, answers: bool):
+    """Sustituye los trabajos en segundo plano de esta sesión por los que necesita la tarjeta actual.
+
+    Los de páginas que ya no vienen (porque `next_index` avanzó o saltó) se cancelan.
+    """
+    jobs = []
+    current = st.session_state.current_idx
+    if answers and not st.session_state.get("reveal", False):
+        jobs.append(((doc_id, current, dpi, encoder.key, "right"),
+                     partial(get_half_cached, doc_id, current, dpi, encoder, "right"), PRIORITY_VISIBLE))
+    for n, page_index in enumerate(upcoming_indices(count)):
+        priority = PRIORITY_NEXT if n == 0 else PRIORITY_PREFETCH
+        if answers:
+            jobs.append(((doc_id, page_index, dpi, encoder.key),
+                         partial(get_halves_cached, doc_id, page_index, dpi, encoder), priority))
+        else:
+            jobs.append(((doc_id, page_index, dpi, encoder.key, "left"),
+                         partial(get_half_cached, doc_id, page_index, dpi, encoder, "left"), priority))
+    get_render_scheduler().replace(session_key(), jobs)
+
+def render_debug_panel():
+    """Tabla de tiempos por etapa y contadores, con exportación Prometheus / JSON lines."""
+    snap = METRICS.snapshot()
+    st.subheader("🔧 Depuración")
+    st.table([
+        {
+            "etapa": name,
+            "n": s["count"],
+            "media ms": round(1000 * s["total"] / s["count"], 1),
+            "máx ms": round(1000 * s["max"], 1),
+            "última ms": round(1000 * s["last"], 1),
+        }
+        for name, s in sorted(snap["stages"].items())
+    ])
+    st.table([{"evento": name, "total": value} for name, value in sorted(snap["counters"].items())])
+    st.table([{"medidor": name, "valor": value} for name, value in sorted(snap["gauges"].items())])
+    st.download_button("Exportar Prometheus", METRICS.to_prometheus(), file_name="hanzi_metrics.prom",
+                       mime="text/plain", use_container_width=True)
+    st.download_button("Exportar JSON lines", METRICS.to_json_line() + "\n", file_name="hanzi_metrics.jsonl",
+                       mime="application/x-ndjson", use_container_width=True)
+
+def export_metrics():
+    """Vuelca las métricas a los archivos de HANZI_METRICS_PROM_FILE / HANZI_METRICS_JSONL, si están definidos."""
+    prom_path = os.environ.get("HANZI_METRICS_PROM_FILE")
+    if prom_path:
+        # Escritura atómica, como espera el textfile collector de node_exporter
+        tmp_path = f"{prom_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(METRICS.to_prometheus())
+        os.replace(tmp_path, prom_path)
+    jsonl_path = os.environ.get("HANZI_METRICS_JSONL")
+    if jsonl_path:
+        with open(jsonl_path, "a") as f:
+            f.write(METRICS.to_json_line() + "\n")
 
 def init_deck(total_pages: int):
+    # La baraja nueva deja obsoleta toda la precarga pendiente de esta sesión
+    get_render_scheduler().cancel(session_key())
     order = list(range(total_pages))
     random.shuffle(order)
     st.session_state.order = order
@@ -81,12 +522,41 @@ def next_index(total_pages: int, no_repeats: bool) -> int:
     else:
         return random.randrange(0, total_pages)
 
-if uploaded:
-    pdf_bytes = uploaded.read()
-    total = get_page_count(pdf_bytes)
+def select_deck() -> Optional[Tuple[str, int]]:
+    """Mazo elegido de la biblioteca o subido; devuelve (doc_id, páginas) o None si aún no hay."""
+    library = get_deck_library()
+    if library is not None and library.decks:
+        source = st.radio("Mazo", ["📚 Biblioteca", "📄 Subir PDF"], horizontal=True, label_visibility="collapsed")
+        if source == "📚 Biblioteca":
+            name = st.selectbox(
+                "📚 Elige un mazo", [deck.name for deck in library.decks],
+                format_func=lambda name: f"{name} ({library.get(name).page_count} páginas)",
+            )
+            deck = library.get(name)
+            # Ya hasheado e indexado al arrancar: ni subida ni lectura del PDF
+            return deck.doc_id, deck.page_count
+    uploaded = st.file_uploader("📄 Sube el PDF (cada página contiene izquierda/derecha)", type=["pdf"])
+    if not uploaded:
+        return None
+    # Solo se hashea el PDF la primera vez que se ve esta subida
+    doc_id = get_document_registry().register(uploaded)
+    return doc_id, get_page_count(doc_id)
+
+selected = select_deck()
 
-    # Inicialización de estado
-    if "current_idx" not in st.session_state:
+if selected:
+    encoder = get_image_encoder()
+    doc_id, total = selected
+    viewport = None
+    if auto_dpi:
+        viewport = client_viewport()
+        if viewport is not None:
+            dpi = viewport_dpi(get_page_width(doc_id), viewport)
+
+    # Inicialización de estado (y al cambiar de mazo, baraja nueva)
+    if "current_idx" not in st.session_state or st.session_state.get("doc_id") != doc_id:
+        st.session_state.doc_id = doc_id
+        init_deck(total)
         st.session_state.current_idx = next_index(total, no_repeats)
         st.session_state.reveal = False
 
@@ -96,15 +566,65 @@ if uploaded:
         if no_repeats:
             st.info(f"Progreso: {st.session_state.get('pos', 0)} / {total}")
         st.button("↩️ Reiniciar baraja", use_container_width=True, on_click=lambda: init_deck(total))
+        memory = get_memory_cache()
+        st.caption(
+            f"Caché de imágenes: {memory.bytes_used / 2**20:.1f} / {memory.max_bytes / 2**20:.0f} MB "
+            f"({len(memory)} mitades)"
+        )
+        if auto_dpi and viewport is not None:
+            st.caption(f"Resolución automática: {dpi} DPI (ventana de {viewport[0]} px, ×{viewport[1]:g})")
+        snap = METRICS.snapshot()
+        skipped = snap["counters"].get("right_half_skipped", 0)
+        if skipped:
+            render_stats = snap["stages"].get("render")
+            saved = skipped * render_stats["total"] / render_stats["count"] if render_stats else 0.0
+            st.caption(f"Respuestas sin renderizar: {skipped} (≈ {saved:.1f} s de render ahorrados)")
+
+    # Render de la página actual: solo la mitad izquierda; la derecha espera a que se revele.
+    # Lo que no está en caché se muestra primero como borrador a baja resolución.
+    def show_half(side: str):
+        """Dibuja la mitad `side` en un hueco nuevo; si es un borrador, la apunta para refinarla."""
+        slot = st.empty()
+        with get_render_scheduler().foreground():
+            data = lookup_half_cached(doc_id, st.session_state.current_idx, dpi, encoder, side)
+            half = (data, dpi) if data is not None else None
+            is_preview = data is None and progressive and dpi > PREVIEW_DPI
+            if is_preview:
+                METRICS.incr("progressive_preview")
+                with METRICS.timer("preview"):
+                    half = get_half_or_fallback(doc_id, st.session_state.current_idx, PREVIEW_DPI, encoder, side)
+                if half is not None:
+                    pending_refine.append((slot, side))
+            elif data is None:
+                half = get_half_or_fallback(doc_id, st.session_state.current_idx, dpi, encoder, side)
+        show_image(slot, half)
+
+    def show_image(slot, half: Optional[Tuple[bytes, int]]):
+        if half is None:
+            slot.warning("⏱️ Esta página tarda demasiado en renderizarse; pasa a la siguiente tarjeta.")
+            return
+        data, data_dpi = half
+        with METRICS.timer("image_transfer"):
+            if encoder.crop:
+                # Una mitad recortada no se estira a la columna: se muestra a escala nativa del DPI elegido
+                # (un borrador, ampliado a ese DPI), así el texto mide lo mismo en todas las tarjetas
+                ratio = viewport[1] if viewport is not None else 1.0
+                width = encoded_width(data) * dpi / (data_dpi * ratio)
+                slot.image(image_source(data, encoder), width=max(1, round(width)))
+            else:
+                slot.image(image_source(data, encoder), use_column_width=True)
+
+    pending_refine = []
 
-    # Render de la página actual
-    left_png, right_png = get_halves_cached(pdf_bytes, st.session_state.current_idx, dpi)
+    # Precarga en segundo plano: el siguiente clic debería ser un acierto de caché.
+    # Los hilos esperan mientras se renderiza en primer plano la tarjeta visible.
+    schedule_warmup(doc_id, dpi, encoder, prefetch_count if no_repeats else 0, prefetch_answers)
 
     col1, col2 = st.columns(2)
     with col1:
         if show_page_number:
             st.markdown(f"**Página {st.session_state.current_idx + 1} / {total} (IZQUIERDA)**")
-        st.image(left_png, use_column_width=True)
+        show_half("left")
 
         # Botones alineados: "Mostrar Respuesta" y "Nueva tarjeta"
         btn_col1, btn_col2 = st.columns([1, 1])
@@ -119,6 +639,9 @@ if uploaded:
 
         with btn_col2:
             def _next_card():
+                if not st.session_state.get("reveal", False) and not is_half_cached(
+                        doc_id, st.session_state.current_idx, dpi, encoder, "right"):
+                    METRICS.incr("right_half_skipped")  # render que la carga diferida se ahorró
                 st.session_state.update({"current_idx": next_index(total, no_repeats)})
                 if not keep_answer_visible:
                     st.session_state.update({"reveal": False})
@@ -128,7 +651,7 @@ if uploaded:
         if st.session_state.get("reveal", False):
             if show_page_number:
                 st.markdown(f"**Página {st.session_state.current_idx + 1} / {total} (DERECHA)**")
-            st.image(right_png, use_column_width=True)
+            show_half("right")
         else:
             st.markdown(
                 "<div style='width:100%;height:100%;border:2px dashed #bbb;border-radius:12px;"
@@ -139,5 +662,21 @@ if uploaded:
 
     st.divider()
     st.caption("Consejo: activa ‘Barajar sin repetición’ para recorrer todas las páginas una sola vez antes de reiniciar.")
+
+    # Los borradores y los botones ya están en el navegador; ahora se renderiza al DPI elegido y se sustituye
+    for slot, side in pending_refine:
+        with get_render_scheduler().foreground():
+            try:
+                data = get_half_cached(doc_id, st.session_state.current_idx, dpi, encoder, side)
+            except RenderTimeout:
+                continue  # se queda el borrador
+        show_image(slot, (data, dpi))
 else:
     st.info("Sube un PDF para comenzar. ")
+
+if show_debug:
+    with st.sidebar:
+        render_debug_panel()
+
+METRICS.observe("rerun", time.perf_counter() - _rerun_start)
+export_metrics()
@@ -0,0 +1,117 @@
+# hanzi_metrics.py
+# Temporizadores por etapa y contadores del pipeline de render, exportables como Prometheus o JSON lines.
+# Cada proceso tiene su propio METRICS; los procesos de render envían los suyos al proceso del app.
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+class _StageStats:
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, count: int, total: float, longest: float, last: float):
+        self.count += count
+        self.total += total
+        self.max = max(self.max, longest)
+        self.last = last
+
+class Metrics:
+    """Acumula la duración de cada etapa (en segundos), contadores de eventos y medidores (último valor)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, _StageStats] = {}
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self._stages.setdefault(stage, _StageStats()).add(1, seconds, seconds, seconds)
+
+    def incr(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def set_gauge(self, gauge: str, value: float):
+        with self._lock:
+            self._gauges[gauge] = value
+
+    def snapshot(self) -> dict:
+        """{"stages": {etapa: {count, total, max, last}}, "counters": {nombre: valor}, "gauges": {nombre: valor}}"""
+        with self._lock:
+            return self._snapshot_locked()
+
+    def drain(self) -> dict:
+        """Como `snapshot`, pero deja las métricas a cero (para enviarlas a otro proceso)."""
+        with self._lock:
+            snap = self._snapshot_locked()
+            self._stages.clear()
+            self._counters.clear()
+            self._gauges.clear()
+        return snap
+
+    def _snapshot_locked(self) -> dict:
+        return {
+            "stages": {
+                name: {"count": s.count, "total": s.total, "max": s.max, "last": s.last}
+                for name, s in self._stages.items()
+            },
+            "counters": dict(self._counters),
+            "gauges": dict(self._gauges),
+        }
+
+    def merge(self, snap: dict):
+        """Suma un `snapshot`/`drain` de otro proceso."""
+        with self._lock:
+            for name, s in snap["stages"].items():
+                self._stages.setdefault(name, _StageStats()).add(s["count"], s["total"], s["max"], s["last"])
+            for name, value in snap["counters"].items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            self._gauges.update(snap.get("gauges", {}))
+
+    def to_prometheus(self, prefix: str = "hanzi") -> str:
+        """Formato de exposición de texto de Prometheus."""
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Tiempo pasado en cada etapa del render.",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for name, s in sorted(snap["stages"].items()):
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {s["total"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+        lines += [
+            f"# HELP {prefix}_events_total Eventos del pipeline (aciertos y fallos de caché, etc.).",
+            f"# TYPE {prefix}_events_total counter",
+        ]
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+        lines += [
+            f"# HELP {prefix}_gauge Valores instantáneos (profundidad de las colas de render, etc.).",
+            f"# TYPE {prefix}_gauge gauge",
+        ]
+        for name, value in sorted(snap["gauges"].items()):
+            lines.append(f'{prefix}_gauge{{name="{name}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+    def to_json_line(self) -> str:
+        """Una línea JSON con marca de tiempo, para añadir a un archivo .jsonl."""
+        return json.dumps({"ts": time.time(), **self.snapshot()}, sort_keys=True)
+
+# Métricas de este proceso
+METRICS = Metrics()
@@ -0,0 +1,131 @@
+# hanzi_prerender.py
+# Renderiza offline todas las páginas de un mazo y llena la caché en disco que usa el app.
+# Uso:  python hanzi_prerender.py mazo.pdf --dpi 200 300 --encoder png webp:80 --cache-dir /srv/hanzi-cache
+# Luego:  HANZI_CACHE_DIR=/srv/hanzi-cache streamlit run hanzi_flashcards.py
+# Con un directorio se precalienta toda la biblioteca:  python hanzi_prerender.py /srv/hsk-decks ...
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Sequence, Tuple
+
+import fitz  # PyMuPDF
+
+from hanzi_cache import DiskCache, RedisCache, SharedCache, cache_dir_from_env, cache_max_bytes_from_env
+from hanzi_render import (
+    COLOR_MODES, ImageEncoder, autocrop_from_env, content_boxes, file_document_id, parse_encoder, render_page_halves, render_tier,
+)
+
+# Estado de cada proceso trabajador: el documento se abre una sola vez por proceso
+_worker_doc: Optional["fitz.Document"] = None
+_worker_cache: Optional[SharedCache] = None
+
+def _init_worker(pdf_path: str, cache_root: str, max_bytes: int, redis_url: Optional[str]):
+    global _worker_doc, _worker_cache
+    _worker_doc = fitz.open(pdf_path)
+    _worker_cache = RedisCache(redis_url) if redis_url else DiskCache(cache_root, max_bytes)
+
+def _render_pages(doc_id: str, pages: Sequence[int], dpis: Sequence[int],
+                  encoders: Sequence[ImageEncoder], force: bool) -> Tuple[int, int]:
+    """Renderiza un lote de páginas; devuelve (mitades escritas, mitades ya en caché)."""
+    written = skipped = 0
+    for page_index in pages:
+        crop = None  # las cajas de recorte se calculan una vez por página, solo si hacen falta
+        for dpi in dpis:
+            for encoder in encoders:
+                if not force and _worker_cache.get_halves(doc_id, page_index, dpi, encoder) is not None:
+                    skipped += 2
+                    continue
+                if encoder.crop and crop is None:
+                    crop = content_boxes(_worker_doc.load_page(page_index))
+                halves = render_page_halves(_worker_doc, page_index, dpi, encoder, crop if encoder.crop else None)
+                _worker_cache.put_halves(doc_id, page_index, dpi, encoder, halves)
+                written += 2
+    return written, skipped
+
+def _expand_pdfs(paths: Sequence[str]) -> List[str]:
+    """Los PDF indicados, con los directorios sustituidos por todos los PDF que contienen."""
+    pdfs = []
+    for path in paths:
+        if not os.path.isdir(path):
+            pdfs.append(path)
+            continue
+        for dirpath, _dirnames, filenames in os.walk(path):
+            pdfs.extend(sorted(os.path.join(dirpath, name) for name in filenames if name.lower().endswith(".pdf")))
+    return pdfs
+
+def _batches(total: int, size: int) -> List[range]:
+    return [range(start, min(start + size, total)) for start in range(0, total, size)]
+
+def _prerender(pdf: str, args: argparse.Namespace, encoders: Sequence[ImageEncoder]) -> Tuple[int, int]:
+    """Pre-renderiza un PDF; devuelve (mitades escritas, mitades ya en caché)."""
+    doc_id = file_document_id(pdf)
+    with fitz.open(pdf) as doc:
+        total = doc.page_count
+    print(f"{pdf}: {total} páginas, doc_id {doc_id}, {args.jobs} procesos", file=sys.stderr)
+
+    written = skipped = 0
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker,
+                             initargs=(pdf, args.cache_dir, args.max_mb * 1024 * 1024, args.redis_url)) as pool:
+        futures = [
+            pool.submit(_render_pages, doc_id, batch, args.dpi, encoders, args.force)
+            for batch in _batches(total, args.batch)
+        ]
+        for done, future in enumerate(as_completed(futures), start=1):
+            batch_written, batch_skipped = future.result()
+            written += batch_written
+            skipped += batch_skipped
+            print(f"  lote {done}/{len(futures)}", file=sys.stderr, end="\r")
+    print(file=sys.stderr)
+    return written, skipped
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-renderiza un mazo PDF en la caché de disco del app.")
+    parser.add_argument("pdf", nargs="+", help="PDF del mazo, o directorio de la biblioteca (HANZI_LIBRARY_DIR)")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[200],
+                        help="DPI que se usarán en el app; se renderiza el nivel de la pirámide del que salen")
+    parser.add_argument("--encoder", nargs="+", default=["png"],
+                        help="Codificadores formato[:calidad|nivel], p. ej. png, png:6, jpeg:85, webp:80")
+    parser.add_argument("--color", choices=COLOR_MODES, default=os.environ.get("HANZI_COLOR_MODE", "auto"),
+                        help="Modo de color del render; debe ser el mismo que use el app (HANZI_COLOR_MODE)")
+    parser.add_argument("--autocrop", action="store_true", default=autocrop_from_env(),
+                        help="Recorta los márgenes en blanco de cada mitad; debe coincidir con HANZI_AUTOCROP del app")
+    parser.add_argument("--redis-url",
+                        help="Llena la caché Redis compartida (p. ej. redis://localhost:6379/0) en lugar de la de disco")
+    parser.add_argument("--cache-dir", default=cache_dir_from_env(),
+                        help="Directorio de caché (por defecto HANZI_CACHE_DIR)")
+    parser.add_argument("--max-mb", type=int, default=cache_max_bytes_from_env() // (1024 * 1024),
+                        help="Tope de la caché en MB; debe ser el mismo que use el app")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Procesos en paralelo")
+    parser.add_argument("--batch", type=int, default=8, help="Páginas por tarea")
+    parser.add_argument("--force", action="store_true", help="Re-renderiza aunque ya esté en caché")
+    args = parser.parse_args(argv)
+
+    if not args.cache_dir and not args.redis_url:
+        parser.error("indica --cache-dir o define HANZI_CACHE_DIR")
+    try:
+        encoders = [parse_encoder(spec, args.color, args.autocrop) for spec in args.encoder]
+    except ValueError as exc:
+        parser.error(str(exc))
+    # El app solo lee de disco los niveles de la pirámide; el resto lo reduce a partir de ellos
+    args.dpi = sorted({render_tier(dpi) for dpi in args.dpi})
+    pdfs = _expand_pdfs(args.pdf)
+    if not pdfs:
+        parser.error("no se encontró ningún PDF")
+
+    start = time.perf_counter()
+    written = skipped = 0
+    for pdf in pdfs:
+        pdf_written, pdf_skipped = _prerender(pdf, args, encoders)
+        written += pdf_written
+        skipped += pdf_skipped
+
+    elapsed = time.perf_counter() - start
+    print(f"{written} mitades escritas, {skipped} ya en caché, en {elapsed:.1f} s -> {args.redis_url or args.cache_dir}",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
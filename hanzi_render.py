@@ -0,0 +1,714 @@
+# hanzi_render.py
+# Núcleo de render de las fichas: documentos abiertos, rasterizado por mitades y codificación de imagen.
+# No depende de Streamlit, así lo pueden usar el app, los scripts de benchmark y herramientas offline.
+
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, ContextManager, Dict, Hashable, Iterator, NamedTuple, Optional, Tuple, TypeVar
+
+import fitz  # PyMuPDF
+
+from hanzi_metrics import METRICS
+
+try:
+    import numpy  # opcional: recorte de márgenes por análisis de píxeles
+except ImportError:
+    numpy = None
+
+try:
+    from PIL import Image  # (Pillow: solo para WebP y PNG con nivel de compresión)
+except ImportError:
+    Image = None
+
+# Límites del pool de documentos abiertos (compartido por todas las sesiones)
+DOC_POOL_MAX_DOCS = 8
+DOC_POOL_MAX_BYTES = 1024 * 1024 * 1024
+# Cada cuánto comprueba quien espera un documento si se apartó por un render colgado (segundos)
+_DETACH_POLL = 0.05
+# Cómo se rasteriza cada página:
+#   "split"       – un único get_pixmap de la página completa, cortado en mid_x (el más rápido)
+#   "displaylist" – interpreta la página una vez y rasteriza cada mitad desde la display list
+#   "clip"        – dos get_pixmap recortados (comportamiento original)
+RENDER_MODE = "split"
+# Resoluciones canónicas (pirámide): solo estas se rasterizan con get_pixmap; cualquier
+# otro DPI se obtiene reduciendo el nivel inmediatamente superior. El primero es el borrador.
+RENDER_TIERS = (60, 150, 225, 300)
+
+SIDES = ("left", "right")
+IMAGE_FORMATS = ("png", "jpeg", "webp")
+# Espacio de color del render:
+#   "rgb"     – color completo (comportamiento original)
+#   "gray"    – escala de grises: un tercio de bytes que rasterizar, cachear y codificar
+#   "bilevel" – grises umbralizados a blanco/negro (PNG de 1 bit; requiere Pillow)
+#   "auto"    – gris salvo en las páginas que tienen algún color
+COLOR_MODES = ("rgb", "gray", "bilevel", "auto")
+# Nivel de gris (0–255) por encima del cual un píxel se considera blanco en modo "bilevel"
+BILEVEL_THRESHOLD = 160
+# Formatos con imagen de 1 bit real: JPEG y WebP guardarían el blanco y negro en 8 bits, y más grande
+BILEVEL_FORMATS = ("png",)
+# Resolución de la miniatura con la que "auto" decide si una página tiene color, y tolerancia entre canales
+_COLOR_PROBE_DPI = 9
+_COLOR_TOLERANCE = 24
+# Recorte automático de márgenes: margen que se deja alrededor del contenido (puntos), resolución de la
+# miniatura del análisis por píxeles, gris por debajo del cual un píxel es tinta, y fracción de la mitad
+# que, si la cubren los objetos dibujados, indica un fondo o un escaneo y pide el análisis por píxeles.
+# Lo que cae a menos de _CROP_FOLD_PT del corte (la línea de plegado de muchos mazos) no cuenta como contenido
+CROP_MARGIN_PT = 6
+_CROP_FOLD_PT = 1.5
+_CROP_PROBE_DPI = 36
+_CROP_INK_LEVEL = 200
+_CROP_FULL_COVER = 0.95
+# Páginas cuyas cajas de recorte recuerda cada proceso
+CROP_CACHE_MAX_ENTRIES = 4096
+
+Box = Tuple[float, float, float, float]
+_MIMETYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Tiempo que una página cuyo render hubo que matar falla al instante, sin volver a intentarlo
+QUARANTINE_SECONDS = 600
+# Renders en hilo que superaron el plazo y cuyo resultado se guarda para la siguiente petición
+WATCHDOG_MAX_LATE = 64
+# Renders en hilo que siguen en marcha tras superar el plazo; con tantos, no se empiezan más
+WATCHDOG_MAX_STUCK = 4
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+def _new_document_hash():
+    return hashlib.blake2b(digest_size=16)
+
+def file_document_id(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """ID de contenido de un PDF (leído por bloques); es la clave de todas las cachés de render."""
+    h = _new_document_hash()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def spool_document(fileobj: BinaryIO, directory: str, chunk_size: int = 1024 * 1024) -> Tuple[str, str]:
+    """Copia `fileobj` por bloques a `<directory>/<doc_id>.pdf` mientras lo hashea.
+
+    Devuelve (doc_id, ruta). Nunca tiene el PDF entero en memoria; si ya existe
+    un archivo con ese contenido, se reutiliza y la copia nueva se descarta.
+    """
+    os.makedirs(directory, exist_ok=True)
+    h = _new_document_hash()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+                h.update(chunk)
+                f.write(chunk)
+        doc_id = h.hexdigest()
+        path = os.path.join(directory, f"{doc_id}.pdf")
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return doc_id, path
+
+def open_mapped_document(path: str) -> Tuple["fitz.Document", int]:
+    """Abre un PDF mapeado en memoria (solo lectura); devuelve (documento, tamaño).
+
+    MuPDF lee directamente de las páginas del archivo en la caché del sistema,
+    que comparten todas las sesiones y procesos que abren el mismo mazo. El
+    mapeo vive mientras viva el documento (que guarda la referencia).
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return fitz.open(stream=memoryview(mapped), filetype="pdf"), len(mapped)
+
+class _PooledDocument:
+    __slots__ = ("doc", "size", "lock", "users", "evicted", "detached")
+
+    def __init__(self, doc, size: int):
+        self.doc = doc
+        self.size = size
+        self.lock = threading.Lock()  # fitz.Document no es thread-safe
+        self.users = 0
+        self.evicted = False
+        self.detached = False  # lo retiene un render colgado: quien espere su turno pasa a otro
+
+class DocumentPool:
+    """Mantiene abiertos los `fitz.Document` más usados, con expulsión LRU.
+
+    Abrir un PDF grande re-parsea la tabla xref y los object streams, lo que
+    en mazos escaneados cuesta más que renderizar la página. El pool guarda
+    como mucho `max_docs` documentos y `max_bytes` de PDF fuente abiertos.
+    """
+
+    def __init__(self, opener: Callable[[str], Tuple["fitz.Document", int]],
+                 max_docs: int = DOC_POOL_MAX_DOCS, max_bytes: int = DOC_POOL_MAX_BYTES):
+        self._opener = opener
+        self._max_docs = max_docs
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _PooledDocument]" = OrderedDict()
+        self._bytes = 0
+
+    def is_open(self, doc_id: str) -> bool:
+        """True si el documento está abierto en el pool (p. ej. para no borrar su archivo)."""
+        with self._lock:
+            return doc_id in self._entries
+
+    @contextmanager
+    def document(self, doc_id: str) -> Iterator["fitz.Document"]:
+        """Presta el documento abierto en exclusiva durante el bloque `with`.
+
+        Si mientras se espera turno el documento se aparta con `detach`, se
+        pasa a uno recién abierto en lugar de seguir esperando.
+        """
+        while True:
+            entry = self._acquire(doc_id)
+            if self._lock_entry(entry):
+                break
+            self._release(entry)
+        try:
+            yield entry.doc
+        finally:
+            entry.lock.release()
+            self._release(entry)
+
+    def detach(self, doc_id: str, doc: "fitz.Document"):
+        """Aparta `doc` del pool (lo retiene un render que no termina): los siguientes usos abren otro.
+
+        Se cierra cuando lo suelta su último usuario.
+        """
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is None or entry.doc is not doc:
+                return  # ya apartado o expulsado
+            del self._entries[doc_id]
+            self._bytes -= entry.size
+            entry.evicted = entry.detached = True
+        METRICS.incr("document_detached")
+
+    @staticmethod
+    def _lock_entry(entry: _PooledDocument) -> bool:
+        while not entry.lock.acquire(timeout=_DETACH_POLL):
+            if entry.detached:
+                return False
+        return True
+
+    def _acquire(self, doc_id: str) -> _PooledDocument:
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None:
+                self._entries.move_to_end(doc_id)
+                entry.users += 1
+                return entry
+        # Abrir fuera del candado global: puede tardar en PDFs grandes
+        with METRICS.timer("fitz_open"):
+            doc, size = self._opener(doc_id)
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None:
+                # Otra sesión lo abrió mientras tanto
+                doc.close()
+            else:
+                entry = _PooledDocument(doc, size)
+                self._entries[doc_id] = entry
+                self._bytes += size
+                self._evict_locked(keep=doc_id)
+            self._entries.move_to_end(doc_id)
+            entry.users += 1
+            return entry
+
+    def _release(self, entry: _PooledDocument):
+        with self._lock:
+            entry.users -= 1
+            close_now = entry.evicted and entry.users == 0
+        if close_now:
+            entry.doc.close()
+
+    def _evict_locked(self, keep: str):
+        while len(self._entries) > 1 and (
+            len(self._entries) > self._max_docs or self._bytes > self._max_bytes
+        ):
+            victim_id = next(iter(self._entries))
+            if victim_id == keep:
+                break
+            victim = self._entries.pop(victim_id)
+            self._bytes -= victim.size
+            victim.evicted = True
+            if victim.users == 0:
+                victim.doc.close()
+
+class SingleFlight:
+    """Une las llamadas concurrentes con la misma clave en una sola ejecución.
+
+    Si 30 sesiones piden a la vez la misma página sin caché, solo la primera
+    la renderiza; las demás esperan su resultado (o su excepción).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            METRICS.incr("render_coalesced")
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def pending(self, key: Hashable) -> Optional[Future]:
+        """El resultado futuro de la llamada en curso con `key`; None si no hay ninguna."""
+        with self._lock:
+            return self._calls.get(key)
+
+class RenderTimeout(Exception):
+    """Un render superó el presupuesto de tiempo por página."""
+
+class _ThreadJob:
+    __slots__ = ("future", "started", "start", "resource", "detached")
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.started = threading.Event()
+        self.start: Optional[float] = None  # time.monotonic() al obtener el recurso
+        self.resource = None
+        self.detached = False
+
+class RenderWatchdog:
+    """Ejecuta cada render con un presupuesto de tiempo.
+
+    Un render de MuPDF no se puede interrumpir desde Python. `run` es para
+    funciones que aplican el plazo ellas mismas y sí lo cortan, como
+    ProcessRenderer, que mata y reinicia el proceso colgado: la clave queda
+    `quarantine` segundos en cuarentena y las peticiones de ese tiempo fallan
+    al instante en lugar de volver a colgarse.
+
+    `run_in_thread` es el modo del propio proceso: el render corre en un hilo
+    y el plazo empieza cuando el hilo obtiene su recurso (el documento), no
+    mientras espera turno. Al agotarse, `on_timeout` aparta el recurso
+    —las demás páginas y el borrador siguen con otro— y el hilo sigue hasta
+    terminar: la siguiente petición de la misma clave recoge su resultado en
+    lugar de lanzar otro render. Con `max_stuck` hilos así, no se empiezan más.
+    """
+
+    def __init__(self, timeout: float, quarantine: float = QUARANTINE_SECONDS,
+                 max_stuck: int = WATCHDOG_MAX_STUCK):
+        self.timeout = timeout
+        self.quarantine = quarantine
+        self.max_stuck = max_stuck
+        self._lock = threading.Lock()
+        self._failed: Dict[Hashable, float] = {}  # clave -> fin de la cuarentena (time.monotonic)
+        self._running: Dict[Hashable, _ThreadJob] = {}  # renders en hilo, hasta que alguien recoge el resultado
+
+    def run(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """`key` identifica el resultado de `fn` (página, DPI, codificador, lado)."""
+        with self._lock:
+            until = self._failed.get(key)
+            if until is not None:
+                if time.monotonic() < until:
+                    METRICS.incr("render_quarantined")
+                    raise RenderTimeout(f"{key!r} ya superó el plazo de {self.timeout:g} s")
+                del self._failed[key]
+        try:
+            return fn()
+        except RenderTimeout:
+            METRICS.incr("render_timeout")
+            now = time.monotonic()
+            with self._lock:
+                # Las cuarentenas vencidas se limpian aquí: la tabla no crece sin límite
+                self._failed = {k: until for k, until in self._failed.items() if until > now}
+                self._failed[key] = now + self.quarantine
+            raise
+
+    def run_in_thread(self, key: Hashable, fn: Callable[[R], T], hold: Callable[[], ContextManager[R]],
+                      on_timeout: Optional[Callable[[R], None]] = None) -> T:
+        """Ejecuta `fn(recurso)` en un hilo, con el recurso que presta `hold()`."""
+        with self._lock:
+            job = self._running.get(key)
+            if job is None:
+                if len(self._running) >= WATCHDOG_MAX_LATE:
+                    self._prune_locked()
+                stuck = self._stuck_locked()
+                if stuck >= self.max_stuck:
+                    METRICS.incr("render_refused")
+                    raise RenderTimeout(f"{stuck} renders siguen colgados en este proceso; "
+                                        "con HANZI_RENDER_WORKERS > 0 se matan y reinician")
+                job = self._running[key] = _ThreadJob()
+                threading.Thread(target=self._target, args=(job, fn, hold), name="hanzi-render-watchdog",
+                                 daemon=True).start()
+            else:
+                METRICS.incr("render_rejoined")
+        job.started.wait()  # la espera por el documento no cuenta para el plazo
+        remaining = self.timeout - (time.monotonic() - job.start) if job.start is not None else 0
+        try:
+            result = job.future.result(timeout=max(0.0, remaining))
+        except FutureTimeoutError:
+            METRICS.incr("render_timeout")
+            with self._lock:
+                detach, job.detached = not job.detached, True
+            if detach and on_timeout is not None:
+                on_timeout(job.resource)
+            raise RenderTimeout(f"el render superó el plazo de {self.timeout:g} s; sigue en segundo plano") from None
+        except BaseException:
+            self._forget(key, job)
+            raise
+        self._forget(key, job)
+        return result
+
+    @staticmethod
+    def _target(job: _ThreadJob, fn: Callable[[R], T], hold: Callable[[], ContextManager[R]]):
+        try:
+            with hold() as resource:
+                job.resource = resource
+                job.start = time.monotonic()
+                job.started.set()
+                result = fn(resource)
+            job.future.set_result(result)
+        except BaseException as exc:
+            job.future.set_exception(exc)
+        finally:
+            job.started.set()
+
+    def _stuck_locked(self) -> int:
+        now = time.monotonic()
+        return sum(1 for job in self._running.values()
+                   if not job.future.done() and job.start is not None and now - job.start > self.timeout)
+
+    def _prune_locked(self):
+        # Resultados tardíos que nadie volvió a pedir: se descartan los terminados
+        for key, job in list(self._running.items()):
+            if job.future.done():
+                del self._running[key]
+
+    def _forget(self, key: Hashable, job: _ThreadJob):
+        with self._lock:
+            if self._running.get(key) is job:
+                del self._running[key]
+
+def render_timeout_from_env() -> Optional[float]:
+    """Plazo por página en segundos según HANZI_RENDER_TIMEOUT (20 por defecto); None si es 0."""
+    timeout = float(os.environ.get("HANZI_RENDER_TIMEOUT", "20"))
+    return timeout if timeout > 0 else None
+
+class ImageEncoder(NamedTuple):
+    """Cómo se codifica cada mitad antes de cachearla y enviarla al navegador.
+
+    - "png": sin `png_level` usa el codificador nativo de MuPDF; con nivel 0–9 usa Pillow.
+    - "jpeg": codificador nativo de MuPDF con `quality` 1–100.
+    - "webp": requiere Pillow; `quality` 1–100.
+
+    `color` (uno de COLOR_MODES) decide también el espacio de color del render y
+    `crop` si cada mitad se recorta a su contenido: describen la imagen que sale
+    del pipeline, y por eso forman parte de `key`.
+    """
+    format: str = "png"
+    quality: int = 85
+    png_level: Optional[int] = None
+    color: str = "rgb"
+    crop: bool = False
+
+    @property
+    def key(self) -> str:
+        """Identificador corto y estable, apto para claves de caché y nombres de archivo."""
+        if self.format == "png":
+            key = "png" if self.png_level is None else f"png{self.png_level}"
+        else:
+            key = f"{self.format}{self.quality}"
+        if self.color != "rgb":
+            key = f"{key}-{self.color}"
+        return f"{key}-crop" if self.crop else key
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.format == "jpeg" else self.format
+
+    @property
+    def mimetype(self) -> str:
+        return _MIMETYPES[self.format]
+
+    def encode(self, pix: "fitz.Pixmap") -> bytes:
+        with METRICS.timer("encode"):
+            return self._encode(pix)
+
+    def _encode(self, pix: "fitz.Pixmap") -> bytes:
+        if self.color == "bilevel":
+            return self._encode_bilevel(pix)
+        if self.format == "png" and self.png_level is None:
+            return pix.tobytes("png")
+        if self.format == "jpeg":
+            return pix.tobytes("jpg", jpg_quality=self.quality)
+        if Image is None:
+            raise RuntimeError(
+                f"El formato {self.key!r} requiere Pillow. Instálalo con:  pip install pillow"
+            )
+        if self.format == "png":
+            return pix.pil_tobytes(format="PNG", compress_level=self.png_level)
+        return pix.pil_tobytes(format="WEBP", quality=self.quality)
+
+    def _encode_bilevel(self, pix: "fitz.Pixmap") -> bytes:
+        if Image is None:
+            raise RuntimeError("El modo de color 'bilevel' requiere Pillow. Instálalo con:  pip install pillow")
+        if pix.n != 1:
+            pix = fitz.Pixmap(fitz.csGRAY, pix)
+        return self.save_pil(_threshold(Image.frombytes("L", (pix.width, pix.height), pix.samples)))
+
+    def save_pil(self, img: "Image.Image") -> bytes:
+        """Codifica una imagen de Pillow con este codificador."""
+        out = io.BytesIO()
+        if self.format == "png":
+            # Una imagen en modo "1" se guarda como PNG de 1 bit
+            img.save(out, format="PNG", compress_level=6 if self.png_level is None else self.png_level)
+        elif self.format == "jpeg":
+            img.convert("L" if img.mode in ("1", "L") else "RGB").save(out, format="JPEG", quality=self.quality)
+        else:
+            img.convert("L" if img.mode in ("1", "L") else "RGB").save(out, format="WEBP", quality=self.quality)
+        return out.getvalue()
+
+def _threshold(img: "Image.Image") -> "Image.Image":
+    """Grises a blanco y negro puros (modo "1")."""
+    return img.convert("L").point(lambda v: 255 if v >= BILEVEL_THRESHOLD else 0, mode="1")
+
+def render_tier(dpi: int) -> int:
+    """El nivel de la pirámide del que se obtiene `dpi` (el propio `dpi` si supera el último)."""
+    return next((tier for tier in RENDER_TIERS if tier >= dpi), dpi)
+
+def dpi_for_width(width_pt: float, width_px: int) -> int:
+    """DPI al que una mitad de una página de `width_pt` puntos mide `width_px` píxeles."""
+    return max(1, round(width_px * 72.0 / (width_pt / 2.0)))
+
+def downscale_encoded(data: bytes, factor: float, encoder: ImageEncoder) -> bytes:
+    """Reduce una imagen ya codificada por `encoder` a `factor` de su tamaño y la vuelve a codificar.
+
+    Decodificar y escalar cuesta mucho menos que volver a interpretar la página con get_pixmap.
+    """
+    with METRICS.timer("downscale"):
+        if encoder.format == "webp":
+            # MuPDF no decodifica WebP; si hay imágenes WebP es que Pillow está instalado
+            img = Image.open(io.BytesIO(data))
+            size = (max(1, round(img.width * factor)), max(1, round(img.height * factor)))
+            img = img.resize(size, Image.LANCZOS)
+            return encoder.save_pil(_threshold(img) if encoder.color == "bilevel" else img)
+        pix = fitz.Pixmap(data)
+        small = fitz.Pixmap(pix, max(1, round(pix.width * factor)), max(1, round(pix.height * factor)))
+    return encoder.encode(small)
+
+def encoded_width(data: bytes) -> int:
+    """Ancho en píxeles de una imagen codificada (con Pillow, leyendo solo la cabecera)."""
+    if Image is not None:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.width
+    return fitz.Pixmap(data).width  # sin Pillow no hay WebP: MuPDF decodifica PNG y JPEG
+
+def _check_color(color: str, fmt: str) -> str:
+    color = color.strip().lower()
+    if color not in COLOR_MODES:
+        raise ValueError(f"Modo de color desconocido {color!r}; usa uno de {COLOR_MODES}")
+    if color == "bilevel" and fmt not in BILEVEL_FORMATS:
+        # JPEG y WebP no tienen 1 bit: los bordes duros del umbral solo añaden artefactos y bytes
+        raise ValueError(f"El modo 'bilevel' solo admite {BILEVEL_FORMATS}, no {fmt!r}")
+    return color
+
+def parse_encoder(spec: str, color: str = "rgb", crop: bool = False) -> ImageEncoder:
+    """Convierte "png", "png:6", "jpeg:80" o "webp:75" en un ImageEncoder con el modo de color `color`."""
+    fmt, _, param = spec.strip().lower().partition(":")
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"Formato de imagen desconocido {fmt!r}; usa uno de {IMAGE_FORMATS}")
+    color = _check_color(color, fmt)
+    if fmt == "png":
+        return ImageEncoder("png", png_level=int(param) if param else None, color=color, crop=crop)
+    return ImageEncoder(fmt, quality=int(param) if param else ImageEncoder().quality, color=color, crop=crop)
+
+def encoder_from_env() -> ImageEncoder:
+    """Lee el codificador del despliegue desde HANZI_IMAGE_FORMAT / HANZI_IMAGE_QUALITY / HANZI_PNG_LEVEL,
+    HANZI_COLOR_MODE y HANZI_AUTOCROP."""
+    fmt = os.environ.get("HANZI_IMAGE_FORMAT", "png").strip()
+    # El mismo formato que --encoder de hanzi_prerender: "png:6", "jpeg:80"…
+    param = os.environ.get("HANZI_PNG_LEVEL" if fmt.lower() == "png" else "HANZI_IMAGE_QUALITY", "").strip()
+    spec = f"{fmt}:{param}" if param else fmt
+    return parse_encoder(spec, os.environ.get("HANZI_COLOR_MODE", "auto"), autocrop_from_env())
+
+def autocrop_from_env() -> bool:
+    """HANZI_AUTOCROP=1 recorta los márgenes en blanco de cada mitad (desactivado por defecto)."""
+    return os.environ.get("HANZI_AUTOCROP", "0").strip().lower() in ("1", "true", "yes")
+
+def page_has_color(page: "fitz.Page") -> bool:
+    """True si alguna zona de la página tiene color (comparando canales en una miniatura RGB)."""
+    scale = _COLOR_PROBE_DPI / 72.0
+    samples = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False).samples
+    return any(
+        max(r, g, b) - min(r, g, b) > _COLOR_TOLERANCE
+        for r, g, b in zip(samples[0::3], samples[1::3], samples[2::3])
+    )
+
+def page_colorspace(page: "fitz.Page", color: str) -> "fitz.Colorspace":
+    """Espacio de color en que se rasteriza `page` para el modo `color`."""
+    if color == "rgb" or (color == "auto" and page_has_color(page)):
+        return fitz.csRGB
+    return fitz.csGRAY
+
+def _split_pixmap(pix: "fitz.Pixmap") -> Tuple["fitz.Pixmap", "fitz.Pixmap"]:
+    """Corta un pixmap de página completa en sus mitades izquierda y derecha."""
+    bbox = fitz.IRect(pix.irect)
+    mid_x = bbox.x0 + pix.width // 2
+    halves = []
+    for box in (fitz.IRect(bbox.x0, bbox.y0, mid_x, bbox.y1), fitz.IRect(mid_x, bbox.y0, bbox.x1, bbox.y1)):
+        half = fitz.Pixmap(pix.colorspace, box, pix.alpha)
+        half.copy(pix, box)  # copia de filas (memcpy), sin volver a rasterizar
+        halves.append(half)
+    return halves[0], halves[1]
+
+def rasterize_halves(page: "fitz.Page", dpi: int, color: str = "rgb") -> Tuple["fitz.Pixmap", "fitz.Pixmap"]:
+    """Rasteriza una página y devuelve los pixmaps (izquierda, derecha)."""
+    with METRICS.timer("get_pixmap"):
+        return _rasterize_halves(page, dpi, page_colorspace(page, color))
+
+def _rasterize_halves(page: "fitz.Page", dpi: int, cs: "fitz.Colorspace") -> Tuple["fitz.Pixmap", "fitz.Pixmap"]:
+    scale = dpi / 72.0  # 72 dpi base en PDF
+    mat = fitz.Matrix(scale, scale)
+
+    if RENDER_MODE == "split":
+        return _split_pixmap(page.get_pixmap(matrix=mat, colorspace=cs, alpha=False))
+    left_rect = _half_rect(page.rect, "left")
+    right_rect = _half_rect(page.rect, "right")
+    # La display list se construye una sola vez y se rasteriza por mitades
+    source = page.get_displaylist() if RENDER_MODE == "displaylist" else page
+    left_pix = source.get_pixmap(matrix=mat, colorspace=cs, clip=left_rect, alpha=False)
+    right_pix = source.get_pixmap(matrix=mat, colorspace=cs, clip=right_rect, alpha=False)
+    return left_pix, right_pix
+
+def _half_rect(rect: "fitz.Rect", side: str) -> "fitz.Rect":
+    mid_x = rect.x0 + rect.width / 2.0
+    if side == "left":
+        return fitz.Rect(rect.x0, rect.y0, mid_x, rect.y1)
+    return fitz.Rect(mid_x, rect.y0, rect.x1, rect.y1)
+
+def rasterize_half(page: "fitz.Page", dpi: int, side: str, color: str = "rgb",
+                   crop: Optional[Box] = None) -> "fitz.Pixmap":
+    """Rasteriza solo una mitad ("left" o "right") de la página, o solo su caja `crop` si se indica."""
+    scale = dpi / 72.0
+    clip = fitz.Rect(crop) if crop is not None else _half_rect(page.rect, side)
+    with METRICS.timer("get_pixmap"):
+        return page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=page_colorspace(page, color),
+                               clip=clip, alpha=False)
+
+def content_boxes(page: "fitz.Page") -> Tuple[Box, Box]:
+    """Caja del contenido de cada mitad (izquierda, derecha) en puntos, con CROP_MARGIN_PT de margen.
+
+    Primero se unen las cajas de todo lo que dibuja la página (texto, trazos,
+    imágenes). Si eso cubre casi toda la mitad —un fondo blanco pintado o un
+    escaneo— y NumPy está instalado, se busca la tinta en una miniatura en
+    grises. Depende solo de la página, no del DPI: se calcula una vez por página.
+    """
+    halves = [_half_rect(page.rect, side) for side in SIDES]
+    left, right = halves
+    inner = [fitz.Rect(left.x0, left.y0, left.x1 - _CROP_FOLD_PT, left.y1),
+             fitz.Rect(right.x0 + _CROP_FOLD_PT, right.y0, right.x1, right.y1)]
+    drawn = [fitz.Rect() for _side in SIDES]
+    for kind, bbox in page.get_bboxlog():
+        if kind.startswith(("clip", "ignore")):
+            continue  # recortes y texto invisible (capas OCR) no pintan nada
+        rect = fitz.Rect(bbox)
+        for i, probe in enumerate(inner):
+            part = rect & probe
+            if not part.is_empty:
+                drawn[i] = drawn[i] | part
+    boxes = []
+    for box, half, probe in zip(drawn, halves, inner):
+        if box.is_empty:
+            box = half  # mitad en blanco: se deja tal cual
+        elif numpy is not None and box.get_area() >= _CROP_FULL_COVER * probe.get_area():
+            box = _ink_box(page, probe) or half
+        m = CROP_MARGIN_PT
+        box = fitz.Rect(box.x0 - m, box.y0 - m, box.x1 + m, box.y1 + m) & half
+        boxes.append(tuple(box))
+    return boxes[0], boxes[1]
+
+def _ink_box(page: "fitz.Page", half: "fitz.Rect") -> Optional["fitz.Rect"]:
+    """Caja de los píxeles con tinta de `half`, vectorizada con NumPy; None si no hay tinta."""
+    scale = _CROP_PROBE_DPI / 72.0
+    with METRICS.timer("crop_probe"):
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=half, colorspace=fitz.csGRAY, alpha=False)
+        ink = numpy.frombuffer(pix.samples, dtype=numpy.uint8).reshape(pix.height, pix.width) < _CROP_INK_LEVEL
+        rows = numpy.flatnonzero(ink.any(axis=1))
+        cols = numpy.flatnonzero(ink.any(axis=0))
+    if rows.size == 0:
+        return None
+    # Píxeles de la miniatura a puntos, relativos al origen del recorte
+    irect = fitz.IRect(pix.irect)
+    x0, y0 = irect.x0 / scale, irect.y0 / scale
+    return fitz.Rect(x0 + cols[0] / scale, y0 + rows[0] / scale,
+                     x0 + (cols[-1] + 1) / scale, y0 + (rows[-1] + 1) / scale)
+
+class CropBoxCache:
+    """Cajas de `content_boxes` por (doc_id, página), con expulsión LRU.
+
+    Se consulta con el documento ya prestado por el DocumentPool, dentro del
+    propio render: así el cálculo corre bajo el watchdog (o en el proceso de
+    render) y se hace una sola vez por página, sea cual sea el DPI.
+    """
+
+    def __init__(self, max_entries: int = CROP_CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._boxes: "OrderedDict[Tuple[str, int], Tuple[Box, Box]]" = OrderedDict()
+
+    def get(self, doc_id: str, doc: "fitz.Document", page_index: int) -> Tuple[Box, Box]:
+        key = (doc_id, page_index)
+        with self._lock:
+            boxes = self._boxes.get(key)
+            if boxes is not None:
+                self._boxes.move_to_end(key)
+                return boxes
+        with METRICS.timer("content_boxes"):
+            boxes = content_boxes(doc.load_page(page_index))
+        with self._lock:
+            self._boxes[key] = boxes
+            while len(self._boxes) > self._max_entries:
+                self._boxes.popitem(last=False)
+        return boxes
+
+def render_page_half(doc: "fitz.Document", page_index: int, dpi: int, side: str,
+                     encoder: ImageEncoder = ImageEncoder(), crop: Optional[Box] = None) -> bytes:
+    """Una sola mitad codificada; cuando solo hace falta un lado cuesta la mitad que `render_page_halves`.
+
+    `crop` es la caja de `content_boxes` para este lado (solo si `encoder.crop`).
+    """
+    return encoder.encode(rasterize_half(doc.load_page(page_index), dpi, side, encoder.color, crop))
+
+def render_page_halves(doc: "fitz.Document", page_index: int, dpi: int,
+                       encoder: ImageEncoder = ImageEncoder(),
+                       crop: Optional[Tuple[Box, Box]] = None) -> Tuple[bytes, bytes]:
+    """Devuelve (left_bytes, right_bytes) codificados con `encoder` para una página de `doc`.
+
+    Con `crop` (las cajas de `content_boxes`), cada mitad se rasteriza recortada a su caja.
+    """
+    page = doc.load_page(page_index)
+    if crop is not None:
+        left, right = (rasterize_half(page, dpi, side, encoder.color, box) for side, box in zip(SIDES, crop))
+        return encoder.encode(left), encoder.encode(right)
+    left_pix, right_pix = rasterize_halves(page, dpi, encoder.color)
+    return encoder.encode(left_pix), encoder.encode(right_pix)
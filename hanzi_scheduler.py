@@ -0,0 +1,141 @@
+# hanzi_scheduler.py
+# Planificador de renders en segundo plano con prioridades: la tarjeta visible nunca espera
+# detrás de trabajo especulativo. No depende de Streamlit.
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Set, Tuple
+
+from hanzi_metrics import METRICS
+
+# Prioridades (menor = antes)
+PRIORITY_VISIBLE = 0   # la tarjeta en pantalla (p. ej. su respuesta)
+PRIORITY_NEXT = 1      # la siguiente tarjeta del orden barajado
+PRIORITY_PREFETCH = 2  # precarga más profunda
+PRIORITY_NAMES = {PRIORITY_VISIBLE: "visible", PRIORITY_NEXT: "next", PRIORITY_PREFETCH: "prefetch"}
+
+class _Job:
+    __slots__ = ("key", "fn", "priority", "groups", "enqueued")
+
+    def __init__(self, key: Hashable, fn: Callable[[], object], priority: int):
+        self.key = key
+        self.fn = fn
+        self.priority = priority
+        self.groups: Set[Hashable] = set()
+        self.enqueued = time.perf_counter()
+
+class RenderScheduler:
+    """Cola de prioridad atendida por `workers` hilos, con trabajos agrupados por sesión.
+
+    - Un mismo `key` pedido por varias sesiones se encola una sola vez, con la
+      prioridad más alta que se le haya pedido.
+    - Mientras haya un render en primer plano (`foreground`), los hilos no
+      empiezan trabajos nuevos: el que ya está en marcha termina, pero nada
+      más compite con la tarjeta visible por la CPU ni por el documento.
+    - `replace` y `cancel` descartan los trabajos pendientes que una sesión ya
+      no necesita; solo se cancela un trabajo cuando ninguna sesión lo quiere.
+    """
+
+    def __init__(self, workers: int):
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[int, int, _Job]] = []
+        self._jobs: Dict[Hashable, _Job] = {}  # solo los pendientes
+        self._seq = itertools.count()
+        self._foreground = 0
+        for n in range(workers):
+            threading.Thread(target=self._worker, name=f"hanzi-render-{n}", daemon=True).start()
+
+    @contextmanager
+    def foreground(self) -> Iterator[None]:
+        """Marca un render en primer plano: mientras dura, se pausa el trabajo especulativo."""
+        with self._cond:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._cond.notify_all()
+
+    def submit(self, group: Hashable, key: Hashable, fn: Callable[[], object], priority: int):
+        with self._cond:
+            self._submit_locked(group, key, fn, priority)
+            self._update_gauges_locked()
+            self._cond.notify()
+
+    def replace(self, group: Hashable, jobs: Iterable[Tuple[Hashable, Callable[[], object], int]]):
+        """Deja como pendientes de `group` exactamente `jobs` (clave, función, prioridad)."""
+        jobs = list(jobs)
+        wanted = {key for key, _fn, _priority in jobs}
+        with self._cond:
+            self._cancel_locked(group, keep=wanted)
+            for key, fn, priority in jobs:
+                self._submit_locked(group, key, fn, priority)
+            self._update_gauges_locked()
+            self._cond.notify_all()
+
+    def cancel(self, group: Hashable):
+        """Descarta todos los trabajos pendientes de `group` (p. ej. al rebarajar)."""
+        with self._cond:
+            self._cancel_locked(group, keep=set())
+            self._update_gauges_locked()
+
+    def depth(self) -> Dict[str, int]:
+        """Trabajos pendientes por prioridad."""
+        with self._cond:
+            return self._depth_locked()
+
+    def _submit_locked(self, group: Hashable, key: Hashable, fn: Callable[[], object], priority: int):
+        job = self._jobs.get(key)
+        if job is None:
+            job = self._jobs[key] = _Job(key, fn, priority)
+        elif priority < job.priority:
+            job.priority = priority  # la entrada anterior del heap queda obsoleta
+        else:
+            job.groups.add(group)
+            return
+        job.groups.add(group)
+        heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+
+    def _cancel_locked(self, group: Hashable, keep: Set[Hashable]):
+        for key, job in list(self._jobs.items()):
+            if group in job.groups and key not in keep:
+                job.groups.discard(group)
+                if not job.groups:
+                    del self._jobs[key]
+                    METRICS.incr("render_job_cancelled")
+
+    def _depth_locked(self) -> Dict[str, int]:
+        depth = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+        for job in self._jobs.values():
+            depth[PRIORITY_NAMES[job.priority]] += 1
+        return depth
+
+    def _update_gauges_locked(self):
+        for name, count in self._depth_locked().items():
+            METRICS.set_gauge(f"render_queue_{name}", count)
+
+    def _next_job(self) -> _Job:
+        with self._cond:
+            while True:
+                while self._foreground or not self._heap:
+                    self._cond.wait()
+                priority, _seq, job = heapq.heappop(self._heap)
+                if self._jobs.get(job.key) is job and job.priority == priority:
+                    del self._jobs[job.key]
+                    self._update_gauges_locked()
+                    return job
+                # Entrada obsoleta: cancelada o reencolada con más prioridad
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            METRICS.observe(f"queue_wait_{PRIORITY_NAMES[job.priority]}", time.perf_counter() - job.enqueued)
+            try:
+                job.fn()
+            except Exception:
+                # Una página que falla aquí volverá a fallar (y se mostrará) en primer plano
+                pass
@@ -0,0 +1,92 @@
+# hanzi_static.py
+# Sirve las mitades renderizadas como archivos estáticos con URL por hash de contenido,
+# para que el navegador (y un proxy inverso) las cacheen en lugar de recibirlas por el websocket.
+# No depende de Streamlit.
+
+import hashlib
+import os
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from hanzi_cache import BoundedDirectory
+from hanzi_render import ImageEncoder
+
+# Una URL por contenido nunca cambia de bytes: el navegador puede guardarla un año sin revalidar
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Interfaces en las que http://localhost:<puerto> es la URL correcta (el navegador está en la misma máquina)
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+class _ImmutableHandler(SimpleHTTPRequestHandler):
+    def end_headers(self):
+        if self.command in ("GET", "HEAD"):
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            self.send_header("Access-Control-Allow-Origin", "*")
+        super().end_headers()
+
+    def list_directory(self, path):
+        self.send_error(404)
+        return None
+
+    def log_message(self, format, *args):
+        pass  # una línea por imagen inundaría el log de Streamlit
+
+class ImageServer:
+    """Publica imágenes en `<root>/<xx>/<hash>.<ext>` y devuelve su URL pública.
+
+    Si se indica `port`, un servidor HTTP en un hilo sirve `root` con cabeceras
+    de caché de larga duración; si no, se supone que otro servidor (p. ej. el
+    proxy inverso) sirve `root` en `base_url`. El directorio es un
+    BoundedDirectory: tope de tamaño con expulsión LRU, como la caché en disco.
+    """
+
+    def __init__(self, root: str, base_url: str, max_bytes: int,
+                 host: str = LOCAL_HOSTS[0], port: Optional[int] = None):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.max_bytes = max_bytes
+        self._dir = BoundedDirectory(root, max_bytes)
+        self._httpd = None
+        if port is not None:
+            self._httpd = ThreadingHTTPServer((host, port), partial(_ImmutableHandler, directory=root))
+            self._httpd.daemon_threads = True
+            threading.Thread(target=self._httpd.serve_forever, name="hanzi-static", daemon=True).start()
+
+    def url_for(self, data: bytes, encoder: ImageEncoder) -> str:
+        """Publica `data` (si no lo estaba ya) y devuelve su URL."""
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        relpath = f"{digest[:2]}/{digest}.{encoder.extension}"
+        path = os.path.join(self.root, relpath)
+        if not self._dir.touch(path):
+            self._dir.write(path, data)
+        return f"{self.base_url}/{relpath}"
+
+    def shutdown(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+
+def image_server_from_env() -> Optional[ImageServer]:
+    """ImageServer según HANZI_IMAGE_PORT / HANZI_IMAGE_BASE_URL; None si ninguna está definida.
+
+    - HANZI_IMAGE_PORT: puerto del servidor interno (p. ej. 8502).
+    - HANZI_IMAGE_HOST: interfaz en la que escucha (127.0.0.1 por defecto).
+    - HANZI_IMAGE_BASE_URL: URL pública de las imágenes. Solo es opcional si el servidor
+      escucha en una interfaz local: entonces vale http://localhost:<puerto>. Sin puerto,
+      otro servidor debe servir HANZI_IMAGE_DIR en esa URL.
+    - HANZI_IMAGE_DIR / HANZI_IMAGE_MAX_MB: directorio y tope (512 MB por defecto).
+    """
+    port = os.environ.get("HANZI_IMAGE_PORT")
+    host = os.environ.get("HANZI_IMAGE_HOST", LOCAL_HOSTS[0])
+    base_url = os.environ.get("HANZI_IMAGE_BASE_URL", "")
+    if not base_url and port:
+        if host not in LOCAL_HOSTS:
+            # Los navegadores de otras máquinas no llegarían a localhost
+            raise ValueError(f"HANZI_IMAGE_BASE_URL es obligatoria si HANZI_IMAGE_HOST ({host}) no es local")
+        base_url = f"http://localhost:{port}"
+    if not base_url:
+        return None
+    root = os.environ.get("HANZI_IMAGE_DIR", os.path.join(tempfile.gettempdir(), "hanzi_flashcards", "static"))
+    max_bytes = int(os.environ.get("HANZI_IMAGE_MAX_MB", "512")) * 1024 * 1024
+    return ImageServer(root, base_url, max_bytes, host=host, port=int(port) if port else None)
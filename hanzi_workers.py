@@ -0,0 +1,153 @@
+# hanzi_workers.py
+# Backend de render en varios procesos: PyMuPDF retiene el GIL casi todo el render,
+# así que un solo proceso de Streamlit solo puede rasterizar una página a la vez.
+
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from hanzi_metrics import METRICS
+from hanzi_render import (
+    SIDES, CropBoxCache, DocumentPool, ImageEncoder, RenderTimeout, open_mapped_document, render_page_half,
+    render_page_halves, render_timeout_from_env,
+)
+
+# Estado de cada proceso trabajador: sus propios documentos abiertos
+_worker_paths: Dict[str, str] = {}
+_worker_pool: Optional[DocumentPool] = None
+_worker_crops = CropBoxCache()
+# Serializa el cambio de `sys.modules["__main__"]` mientras arrancan trabajadores
+_main_lock = threading.Lock()
+
+def _open_worker_document(doc_id: str) -> Tuple["fitz.Document", int]:
+    # Por mmap: todos los trabajadores comparten las mismas páginas del archivo
+    return open_mapped_document(_worker_paths[doc_id])
+
+def _init_worker():
+    global _worker_pool
+    _worker_pool = DocumentPool(_open_worker_document)
+
+def _render_in_worker(doc_id: str, path: str, page_index: int, dpi: int,
+                      encoder: ImageEncoder) -> Tuple[Tuple[bytes, bytes], dict]:
+    """Devuelve las mitades y las métricas del trabajador desde la última petición."""
+    _worker_paths[doc_id] = path
+    with _worker_pool.document(doc_id) as doc:
+        crop = _worker_crops.get(doc_id, doc, page_index) if encoder.crop else None
+        halves = render_page_halves(doc, page_index, dpi, encoder, crop)
+    return halves, METRICS.drain()
+
+def _render_half_in_worker(doc_id: str, path: str, page_index: int, dpi: int, side: str,
+                           encoder: ImageEncoder) -> Tuple[bytes, dict]:
+    _worker_paths[doc_id] = path
+    with _worker_pool.document(doc_id) as doc:
+        crop = _worker_crops.get(doc_id, doc, page_index)[SIDES.index(side)] if encoder.crop else None
+        data = render_page_half(doc, page_index, dpi, side, encoder, crop)
+    return data, METRICS.drain()
+
+@contextmanager
+def _stub_main() -> Iterator[None]:
+    """Mientras dura el bloque, `__main__` es un módulo vacío.
+
+    Un proceso "spawn" vuelve a ejecutar el `__main__` del padre antes de
+    atender nada, y bajo Streamlit ese es el script del app: cada trabajador
+    montaría la página entera (biblioteca, otro ProcessRenderer…) y el pool
+    acabaría roto. Con el módulo vacío solo importa `hanzi_workers`.
+    """
+    with _main_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            yield
+        finally:
+            sys.modules["__main__"] = main
+
+class ProcessRenderer:
+    """Reparte los renders entre `workers` procesos; cada uno mantiene su DocumentPool.
+
+    Los trabajadores abren los PDF desde disco (`path`), así los bytes del
+    documento no viajan con cada petición. Con `timeout`, un render que no
+    termina a tiempo hace matar y reiniciar los procesos y lanza RenderTimeout.
+    Nunca hay más peticiones enviadas que procesos: la espera por un proceso
+    libre no cuenta para el plazo, solo el render.
+    """
+
+    def __init__(self, workers: int, timeout: Optional[float] = None):
+        self.workers = workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # "spawn": hacer fork de un servidor de Streamlit con hilos vivos no es seguro
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+        )
+
+    def render(self, doc_id: str, path: str, page_index: int, dpi: int, encoder: ImageEncoder) -> Tuple[bytes, bytes]:
+        """Renderiza en un proceso libre y espera el resultado (con el recorte de `encoder.crop`, si lo pide)."""
+        return self._call(_render_in_worker, doc_id, path, page_index, dpi, encoder)
+
+    def render_half(self, doc_id: str, path: str, page_index: int, dpi: int, side: str,
+                    encoder: ImageEncoder) -> bytes:
+        """Como `render`, pero solo una mitad."""
+        return self._call(_render_half_in_worker, doc_id, path, page_index, dpi, side, encoder)
+
+    def _call(self, fn: Callable, *args):
+        with self._slots:
+            for attempt in range(2):
+                executor = self._executor
+                try:
+                    future = self._submit(executor, fn, *args)
+                    result, worker_metrics = future.result(timeout=self.timeout)
+                except FutureTimeoutError:
+                    self._restart(executor)
+                    raise RenderTimeout(f"el render superó el plazo de {self.timeout:g} s; proceso reiniciado") from None
+                except BrokenProcessPool:
+                    # Un render colgado hizo reiniciar el pool, o murió un trabajador: pool nuevo y un reintento
+                    self._restart(executor)
+                    if attempt:
+                        raise
+                    continue
+                except RuntimeError:
+                    # `submit` sobre un pool que otro hilo acaba de reiniciar; si no, es un error del propio render
+                    if attempt or executor is self._executor:
+                        raise
+                    continue
+                METRICS.merge(worker_metrics)
+                return result
+
+    @staticmethod
+    def _submit(executor: ProcessPoolExecutor, fn: Callable, *args) -> Future:
+        # El pool arranca sus procesos al vuelo dentro de `submit`: ahí es donde hace falta el `__main__` vacío
+        with _stub_main():
+            return executor.submit(fn, *args)
+
+    def _restart(self, executor: ProcessPoolExecutor):
+        """Mata los procesos de `executor` (el colgado no atendería un cierre ordenado) y crea otros."""
+        with self._lock:
+            if executor is not self._executor:
+                return  # otro hilo ya lo reinició
+            METRICS.incr("render_worker_restart")
+            for process in list((executor._processes or {}).values()):
+                process.kill()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def process_renderer_from_env() -> Optional[ProcessRenderer]:
+    """ProcessRenderer con HANZI_RENDER_WORKERS procesos; None (render en el propio proceso) si es 0."""
+    workers = int(os.environ.get("HANZI_RENDER_WORKERS", "0"))
+    if workers <= 0:
+        return None
+    return ProcessRenderer(workers, render_timeout_from_env())
@@ -0,0 +1,169 @@
+# Pruebas de las cachés compartidas sin servidor: DiskCache en un directorio temporal y
+# RedisCache sobre fakeredis (si está instalado) o un cliente mínimo en memoria.
+
+import os
+
+import pytest
+
+from hanzi_cache import DiskCache, FailSafeCache, RedisCache, redis
+from hanzi_metrics import METRICS
+from hanzi_render import ImageEncoder
+
+ENCODER = ImageEncoder("png")
+HALVES = (b"left-bytes", b"right-bytes")
+
+class StubRedis:
+    """Lo justo de redis-py que usa RedisCache, en un dict."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.ttls[key] = ex
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return StubPipeline(self)
+
+class StubPipeline:
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def set(self, key, value, ex=None):
+        self._calls.append((key, value, ex))
+
+    def execute(self):
+        for key, value, ex in self._calls:
+            self._client.set(key, value, ex=ex)
+
+class DownRedis:
+    """Un servidor caído: cada llamada falla como falla redis-py al no poder conectar."""
+
+    error = redis.ConnectionError if redis is not None else ConnectionError
+
+    def __init__(self):
+        self.calls = 0
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            self.calls += 1
+            raise self.error("Connection refused")
+        return fail
+
+def _counter(name: str) -> int:
+    return METRICS.snapshot()["counters"].get(name, 0)
+
+def _redis_client(kind: str):
+    if kind == "stub":
+        return StubRedis()
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis()
+
+@pytest.fixture(params=["stub", "fakeredis"])
+def redis_client(request):
+    return _redis_client(request.param)
+
+@pytest.fixture(params=["disk", "stub", "fakeredis"])
+def shared_cache(request, tmp_path):
+    if request.param == "disk":
+        return DiskCache(str(tmp_path / "cache"), 1 << 20)
+    return RedisCache("redis://unused", client=_redis_client(request.param))
+
+def test_shared_cache_round_trip(shared_cache):
+    assert shared_cache.get("doc", 3, 150, ENCODER, "left") is None
+    assert not shared_cache.contains("doc", 3, 150, ENCODER, "left")
+    shared_cache.put("doc", 3, 150, ENCODER, "left", b"half")
+    assert shared_cache.get("doc", 3, 150, ENCODER, "left") == b"half"
+    assert shared_cache.contains("doc", 3, 150, ENCODER, "left")
+    # Otro lado, DPI o codificador es otra entrada
+    assert shared_cache.get("doc", 3, 150, ENCODER, "right") is None
+    assert shared_cache.get("doc", 3, 225, ENCODER, "left") is None
+    assert shared_cache.get("doc", 3, 150, ImageEncoder("webp", quality=80), "left") is None
+
+def test_shared_cache_halves(shared_cache):
+    assert shared_cache.get_halves("doc", 0, 225, ENCODER) is None
+    shared_cache.put("doc", 0, 225, ENCODER, "left", HALVES[0])
+    assert shared_cache.get_halves("doc", 0, 225, ENCODER) is None  # falta la derecha
+    shared_cache.put_halves("doc", 0, 225, ENCODER, HALVES)
+    assert shared_cache.get_halves("doc", 0, 225, ENCODER) == HALVES
+    assert shared_cache.get("doc", 0, 225, ENCODER, "right") == HALVES[1]
+
+def test_redis_cache_keys_and_ttl():
+    client = StubRedis()
+    cache = RedisCache("redis://unused", prefix="test", ttl=60, client=client)
+    cache.put_halves("doc", 7, 300, ENCODER, HALVES)
+    assert sorted(client.data) == [
+        f"test:doc:300-{ENCODER.key}:00007-left",
+        f"test:doc:300-{ENCODER.key}:00007-right",
+    ]
+    assert set(client.ttls.values()) == {60}
+
+def test_disk_cache_layout_and_reopen(tmp_path):
+    root = str(tmp_path / "cache")
+    cache = DiskCache(root, 1 << 20)
+    cache.put_halves("doc", 2, 150, ENCODER, HALVES)
+    path = cache.path("doc", 2, 150, ENCODER, "left")
+    assert path == os.path.join(root, "doc", f"150-{ENCODER.key}", "00002-left.png")
+    assert os.path.exists(path)
+    # Sobrevive a un reinicio: otra instancia sobre el mismo directorio lo encuentra y lo cuenta
+    reopened = DiskCache(root, 1 << 20)
+    assert reopened.get_halves("doc", 2, 150, ENCODER) == HALVES
+    assert reopened.bytes_used == sum(len(data) for data in HALVES)
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 3000)
+    for page in range(3):
+        cache.put("doc", page, 150, ENCODER, "left", bytes(900))
+        os.utime(cache.path("doc", page, 150, ENCODER, "left"), (page, page))
+    cache.get("doc", 0, 150, ENCODER, "left")  # la página 0 pasa a ser la más reciente
+    cache.put("doc", 3, 150, ENCODER, "left", bytes(900))
+    assert cache.contains("doc", 0, 150, ENCODER, "left")
+    assert not cache.contains("doc", 1, 150, ENCODER, "left")
+    assert cache.contains("doc", 3, 150, ENCODER, "left")
+    assert cache.bytes_used <= 3000
+
+def test_fail_safe_cache_passes_through(redis_client):
+    cache = FailSafeCache(RedisCache("redis://unused", client=redis_client))
+    cache.put("doc", 0, 150, ENCODER, "left", b"half")
+    assert cache.get("doc", 0, 150, ENCODER, "left") == b"half"
+    assert cache.contains("doc", 0, 150, ENCODER, "left")
+
+def test_fail_safe_cache_on_down_server():
+    client = DownRedis()
+    cache = FailSafeCache(RedisCache("redis://unused", client=client), retry_after=60)
+    errors, skipped = _counter("shared_cache_error"), _counter("shared_cache_skipped")
+    assert cache.get("doc", 0, 150, ENCODER, "left") is None
+    # Mientras dura la pausa no se vuelve a llamar al servidor: son fallos de caché inmediatos
+    cache.put("doc", 0, 150, ENCODER, "left", b"half")
+    assert not cache.contains("doc", 0, 150, ENCODER, "left")
+    assert cache.get_halves("doc", 0, 150, ENCODER) is None
+    cache.put_halves("doc", 0, 150, ENCODER, HALVES)
+    assert client.calls == 1
+    assert _counter("shared_cache_error") == errors + 1
+    assert _counter("shared_cache_skipped") == skipped + 4
+
+def test_fail_safe_cache_retries_after_pause():
+    client = DownRedis()
+    cache = FailSafeCache(RedisCache("redis://unused", client=client), retry_after=0)
+    assert cache.get("doc", 0, 150, ENCODER, "left") is None
+    assert cache.get("doc", 0, 150, ENCODER, "left") is None
+    assert client.calls == 2
+
+def test_fail_safe_cache_on_unwritable_disk(tmp_path):
+    root = tmp_path / "cache"
+    cache = DiskCache(str(root), 1 << 20)
+    (root / "doc").write_bytes(b"")  # un archivo donde la caché necesita un directorio
+    safe = FailSafeCache(cache, retry_after=0)
+    safe.put("doc", 0, 150, ENCODER, "left", b"half")
+    assert safe.get("doc", 0, 150, ENCODER, "left") is None
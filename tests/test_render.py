@@ -0,0 +1,47 @@
+# Pruebas del recorte automático (content_boxes) sobre páginas sintéticas como las del benchmark.
+
+import fitz
+import pytest
+
+from bench_render import build_document
+from hanzi_render import SIDES, _half_rect, content_boxes, numpy
+
+def _first_page(data: bytes) -> "fitz.Page":
+    return fitz.open(stream=data, filetype="pdf").load_page(0)
+
+@pytest.mark.parametrize("kind", ["vector", "cjk"])
+def test_content_boxes_shrink_pages_with_margins(kind):
+    page = _first_page(build_document(kind, 1))
+    for side, box in zip(SIDES, content_boxes(page)):
+        half = _half_rect(page.rect, side)
+        box = fitz.Rect(box)
+        assert half.contains(box)
+        assert box.get_area() < 0.9 * half.get_area(), side
+
+def test_content_boxes_ignore_the_fold_line():
+    doc = fitz.open()
+    page = doc.new_page(width=842, height=595)
+    page.draw_line((421, 0), (421, 595), width=0.5)
+    page.insert_text((100, 300), "左", fontsize=40, fontname="china-s")
+    page.insert_text((600, 300), "右", fontsize=40, fontname="china-s")
+    left, right = (fitz.Rect(box) for box in content_boxes(page))
+    # Solo el carácter más el margen: ni toda la altura ni una franja hasta el pliegue
+    assert left.x1 < 300 and right.x0 > 550
+    assert left.height < 100 and right.height < 100
+
+def test_content_boxes_keep_blank_halves_whole():
+    doc = fitz.open()
+    page = doc.new_page(width=842, height=595)
+    page.insert_text((100, 300), "字", fontsize=40, fontname="china-s")
+    left, right = (fitz.Rect(box) for box in content_boxes(page))
+    assert left.get_area() < _half_rect(page.rect, "left").get_area()
+    assert right == _half_rect(page.rect, "right")
+
+@pytest.mark.skipif(numpy is None, reason="el sondeo de tinta requiere NumPy")
+def test_content_boxes_find_ink_on_painted_background():
+    doc = fitz.open()
+    page = doc.new_page(width=842, height=595)
+    page.draw_rect(page.rect, color=None, fill=(1, 1, 1))  # fondo blanco pintado: cubre toda la página
+    page.insert_text((100, 300), "字", fontsize=40, fontname="china-s")
+    left = fitz.Rect(content_boxes(page)[0])
+    assert left.get_area() < 0.25 * _half_rect(page.rect, "left").get_area()